@@ -0,0 +1,311 @@
+"""GUIを使わずに撮影からPDF出力までを実行する（無人運用・一括処理用）
+
+使い方:
+  python batch_capture.py --area 100 80 1000 1380 --click 1200 700 --count 300 --output book.pdf
+  python batch_capture.py --config jobs.json --summary summary.json
+
+設定ファイル（JSON）は1件のジョブ、ジョブのリスト、または
+{"defaults": {...}, "jobs": [{...}, ...]} のいずれか。キーはオプション名と同じ
+（--adaptive-wait なら "adaptive_wait"）。優先順位は 既定値 < defaults < コマンドライン < 各ジョブ。
+
+ジョブは順番に実行し、最後に結果のJSONを標準出力に書き出す（途中経過は標準エラーに出す）。
+Tk（tkinter）は読み込まない。
+"""
+import argparse
+import contextlib
+import json
+import os
+import signal
+import sys
+import time
+
+from capture_backends import available_backends, default_backend_name
+from capture_session import CaptureSession
+from job_controller import EXPORTING, JobController
+from page_enhance import ENHANCE_CONTRAST, ENHANCE_SHARPNESS
+from page_store import PageStore
+from page_export import EXPORT_LABELS, available_exporters, create_exporter, export_pages, output_size
+from pdf_writer import ExportCancelled, page_layout
+from session_journal import SessionJournal
+from telemetry import NULL_TELEMETRY, Telemetry
+
+JOB_DEFAULTS = {
+    "area": None,
+    "click": None,
+    "count": 10,
+    "output": None,
+    "backend": None,
+    "backend_options": {},
+    "wait": 0.5,
+    "adaptive_wait": False,
+    "skip_duplicates": True,
+    "stop_after": 3,
+    "compact": True,
+    "bilevel": False,
+    "trim": None,
+    "split_spreads": False,
+    "right_to_left": False,
+    "enhance": None,
+    "contrast": ENHANCE_CONTRAST,
+    "sharpness": ENHANCE_SHARPNESS,
+    "quality": 1.5,
+    "upscale": False,
+    "auto_encoding": True,
+    "format": "pdf",
+    "image_format": "png",
+    "append": False,
+    "compact_pdf": False,
+    "edits": [],
+    "telemetry": False,
+    "trace": None,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="電子書籍スクリーンショットをGUIなしで実行します")
+    parser.add_argument("--config", help="ジョブを記述したJSONファイル")
+    parser.add_argument("--summary", help="結果のJSONを書き出すファイル（標準出力にも出す）")
+    parser.add_argument("--area", type=int, nargs=4, metavar=("X1", "Y1", "X2", "Y2"), help="撮影範囲")
+    parser.add_argument("--click", type=int, nargs=2, metavar=("X", "Y"), help="ページめくりのクリック位置")
+    parser.add_argument("--count", type=int, help="撮影枚数")
+    parser.add_argument("--output", help="出力パス（画像フォルダの場合はフォルダ）")
+    parser.add_argument("--format", choices=available_exporters(), help="出力形式（既定: pdf）")
+    parser.add_argument("--image-format", dest="image_format", choices=("png", "webp"),
+                        help="CBZ・画像フォルダに格納する画像の形式（既定: png。webpは可逆圧縮）")
+    parser.add_argument("--backend", choices=available_backends(),
+                        help=f"キャプチャ方式（既定: {default_backend_name()}）")
+    parser.add_argument("--wait", type=float, help="待機時間(秒)。自動検出時は上限")
+    parser.add_argument("--adaptive-wait", action="store_true", default=None, help="ページめくりを自動検出")
+    parser.add_argument("--keep-duplicates", dest="skip_duplicates", action="store_false", default=None,
+                        help="重複ページを除外しない")
+    parser.add_argument("--stop-after", type=int, help="同じページが続いたら終了する回数 (0=無効)")
+    parser.add_argument("--no-compact", dest="compact", action="store_false", default=None,
+                        help="白黒ページもカラーで保持する")
+    parser.add_argument("--bilevel", action="store_true", default=None, help="白黒ページを2値化して保持")
+    parser.add_argument("--split-spreads", dest="split_spreads", action="store_true", default=None,
+                        help="見開きを左右のページに分割する")
+    parser.add_argument("--rtl", dest="right_to_left", action="store_true", default=None,
+                        help="見開きを分割するとき右ページを先にする（右開きの本）")
+    parser.add_argument("--trim", choices=("book", "page"),
+                        help="撮影範囲の余白を格納前に除去する（book=本全体で共通の範囲, page=ページごと）")
+    parser.add_argument("--enhance", dest="enhance", action="store_const", const=True,
+                        help="キャプチャ方式に関わらず鮮明化する（既定はpyautoguiのときだけ）")
+    parser.add_argument("--no-enhance", dest="enhance", action="store_const", const=False, help="鮮明化しない")
+    parser.add_argument("--contrast", type=float, help=f"鮮明化のコントラスト（既定: {ENHANCE_CONTRAST}）")
+    parser.add_argument("--sharpness", type=float, help=f"鮮明化のシャープネス（既定: {ENHANCE_SHARPNESS}）")
+    parser.add_argument("--quality", type=float, help="PDF品質設定（倍率）")
+    parser.add_argument("--upscale", action="store_true", default=None, help="画素を拡大して埋め込む")
+    parser.add_argument("--no-auto-encoding", dest="auto_encoding", action="store_false", default=None,
+                        help="ページ内容に応じた圧縮方式の選択を行わない")
+    parser.add_argument("--append", action="store_true", default=None,
+                        help="出力パスのPDFが既にあれば、増分更新で末尾にページを追加する")
+    parser.add_argument("--compact-pdf", dest="compact_pdf", action="store_true", default=None,
+                        help="追記後にPDFを1つの相互参照表に書き直す")
+    parser.add_argument("--telemetry", action="store_true", default=None,
+                        help="ステージごとの処理時間を計測して結果に含める")
+    parser.add_argument("--trace", help="計測した時間をJSON Lines形式で追記するファイル（--telemetryを含む）")
+    return parser.parse_args(argv)
+
+
+def load_jobs(args):
+    """設定ファイルとコマンドラインからジョブのリストを組み立てる"""
+    options = {key: value for key, value in vars(args).items() if key in JOB_DEFAULTS and value is not None}
+    defaults = dict(JOB_DEFAULTS)
+    entries = [{}]
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            config = json.load(f)
+        if isinstance(config, list):
+            entries = config
+        elif "jobs" in config:
+            defaults.update(config.get("defaults", {}))
+            entries = config["jobs"]
+        else:
+            entries = [config]
+    jobs = []
+    for entry in entries:
+        unknown = set(entry) - set(JOB_DEFAULTS)
+        if unknown:
+            raise ValueError(f"不明な設定項目です: {', '.join(sorted(unknown))}")
+        jobs.append({**defaults, **options, **entry})
+    return jobs
+
+
+# editsに書ける操作（page_edits参照）
+EDIT_OPS = ("crop", "rotate", "trim", "levels")
+
+
+def validate_job(job):
+    if not job["output"]:
+        raise ValueError("出力パスが設定されていません。")
+    if job["format"] not in available_exporters():
+        raise ValueError(f"不明な出力形式です: {job['format']}")
+    if job["append"] and job["format"] != "pdf":
+        raise ValueError("追記はPDF形式のみ対応しています。")
+    if not job["area"] or len(job["area"]) != 4:
+        raise ValueError("スクリーンショット範囲が設定されていません。")
+    if not job["click"] or len(job["click"]) != 2:
+        raise ValueError("クリック位置が設定されていません。")
+    if job["count"] <= 0:
+        raise ValueError("撮影枚数は1以上に設定してください。")
+    if job["trim"] not in (None, "book", "page"):
+        raise ValueError(f"不明な余白除去モードです: {job['trim']}")
+    for op in job["edits"]:
+        if not op or op[0] not in EDIT_OPS:
+            raise ValueError(f"不明な編集操作です: {op}")
+
+
+class BatchRunner:
+    """ジョブを順番に実行する。stop()で実行中のジョブを止め、残りのジョブは実行しない"""
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.controller = JobController()
+        self.cancelled = False
+
+    def stop(self):
+        self.cancelled = True
+        self.controller.stop()
+
+    def run(self):
+        start = time.perf_counter()
+        results = []
+        for number, job in enumerate(self.jobs, 1):
+            if self.cancelled:
+                results.append({"output": job["output"], "status": "skipped"})
+                continue
+            print(f"ジョブ {number}/{len(self.jobs)}: {job['output']}")
+            results.append(self.run_job(job))
+        return {
+            "jobs": results,
+            "total_seconds": round(time.perf_counter() - start, 3),
+            "ok": all(result["status"] == "completed" for result in results),
+        }
+
+    def run_job(self, job):
+        result = {"output": job["output"], "status": "failed"}
+        try:
+            validate_job(job)
+        except ValueError as e:
+            result["error"] = str(e)
+            return result
+
+        journal = SessionJournal.create({
+            "area": list(job["area"]),
+            "click": list(job["click"]),
+            "pdf_path": job["output"],
+            "count": job["count"],
+        })
+        page_store = PageStore(directory=journal.directory)
+        telemetry = Telemetry(job["trace"]) if job["telemetry"] or job["trace"] else NULL_TELEMETRY
+        completed = False
+        try:
+            session = CaptureSession(
+                page_store, journal, job["area"], job["click"], job["count"],
+                backend=job["backend"], backend_options=job["backend_options"], wait_time=job["wait"],
+                adaptive_wait=job["adaptive_wait"], skip_duplicates=job["skip_duplicates"],
+                stop_after_duplicates=job["stop_after"], compact=job["compact"], bilevel=job["bilevel"],
+                trim=job["trim"], split_spreads=job["split_spreads"], right_to_left=job["right_to_left"],
+                enhance=job["enhance"], contrast=job["contrast"], sharpness=job["sharpness"],
+                controller=self.controller, telemetry=telemetry,
+            )
+            capture_start = time.perf_counter()
+            session.run()
+            stats = session.pipeline.stats
+            result.update({
+                "pages": len(page_store),
+                "captured": stats.counts.get("capture", 0),
+                "duplicates": session.duplicate_detector.duplicates,
+                "end_of_book": session.end_of_book,
+                "capture_seconds": round(time.perf_counter() - capture_start, 3),
+                "pages_per_minute": round(stats.pages_per_minute("capture"), 1),
+                "average_seconds": {
+                    stage: round(stats.average_seconds(stage), 4) for stage in ("capture", "process", "store")
+                },
+            })
+            if self.cancelled:
+                result["status"] = "stopped"
+                return result
+            if session.pipeline.error is not None:
+                raise session.pipeline.error
+            if not len(page_store):
+                raise ValueError("保存する画像がありません")
+
+            scale_factor, resolution = page_layout(job["quality"], job["upscale"])
+            page_paths = [page_store.entry(page_id).path for page_id in page_store.page_ids()]
+            # 全ページ共通の編集操作（例: [["trim"], ["rotate", 90]]）は変換時にまとめて適用する
+            ops = tuple(tuple(op) for op in job["edits"])
+            options = {"scale_factor": scale_factor, "quality": 85, "resolution": resolution,
+                       "auto_encoding": job["auto_encoding"]}
+            if job["format"] == "pdf":
+                options.update(append=job["append"], compact=job["compact_pdf"])
+            elif job["format"] in ("cbz", "images"):
+                options["image_format"] = job["image_format"]
+            appended = job["append"] and os.path.exists(job["output"])
+            export_start = time.perf_counter()
+            self.controller.begin(EXPORTING)
+            kinds = export_pages(page_paths, create_exporter(job["format"], job["output"], **options),
+                                 cancel_event=self.controller.stop_event, telemetry=telemetry,
+                                 page_ops=[ops] * len(page_paths) if ops else None)
+            result.update({
+                "status": "completed",
+                "appended": appended,
+                "export_seconds": round(time.perf_counter() - export_start, 3),
+                "output_bytes": output_size(job["output"]),
+                "encodings": {kind: kinds.count(kind) for kind in EXPORT_LABELS if kind in kinds},
+            })
+            completed = True
+        except ExportCancelled:
+            result["status"] = "stopped"
+        except Exception as e:
+            print(f"ジョブのエラー: {e}")
+            result["error"] = str(e)
+        finally:
+            if telemetry.enabled:
+                result["telemetry"] = telemetry.summary()
+            telemetry.close()
+            self.controller.finish()
+            # 進捗の通知は使わないので捨てる
+            self.controller.drain_events()
+            if completed:
+                # 出力まで完了したセッションは再開の対象から外す
+                journal.discard()
+            else:
+                # 未完了のセッションはGUIから再開できるように残す
+                journal.close()
+                result["session"] = journal.directory
+            page_store.close()
+        return result
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        jobs = load_jobs(args)
+    except (OSError, ValueError) as e:
+        print(f"設定の読み込みエラー: {e}", file=sys.stderr)
+        return 2
+
+    runner = BatchRunner(jobs)
+
+    def on_interrupt(signum, frame):
+        print("中断が要求されました。撮影中のページを保存して停止します。", file=sys.stderr)
+        runner.stop()
+        # 2回目の中断は即座に終了させる
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    signal.signal(signal.SIGINT, on_interrupt)
+    # 標準出力は結果のJSONだけにする
+    with contextlib.redirect_stdout(sys.stderr):
+        summary = runner.run()
+
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0 if summary["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
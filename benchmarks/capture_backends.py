@@ -0,0 +1,35 @@
+"""利用可能な各キャプチャ方式の撮影スループットを計測する
+
+使い方: python benchmarks/capture_backends.py [幅] [高さ] [枚数]
+画面のない環境ではsyntheticバックエンドだけが計測される。
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture_backends import available_backends, create_backend  # noqa: E402
+
+
+def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 1200
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 1600
+    frames = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    print(f"{width}x{height}, {frames}枚")
+    for name in available_backends():
+        options = {"page_count": frames} if name == "synthetic" else {}
+        with create_backend(name, **options) as backend:
+            backend.grab(0, 0, width, height)  # 初回の資源確保は計測に含めない
+            start = time.perf_counter()
+            for _ in range(frames):
+                backend.grab(0, 0, width, height)
+                if name == "synthetic":
+                    backend.click(None)
+            elapsed = time.perf_counter() - start
+        print(f"  {name}: {frames / elapsed:.1f}枚/秒 ({elapsed / frames * 1000:.1f} ms/枚)")
+
+
+if __name__ == "__main__":
+    main()
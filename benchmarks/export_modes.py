@@ -0,0 +1,45 @@
+"""原寸埋め込み・画素拡大・内容別圧縮の各出力方式で、PDF出力時間とファイルサイズを比較する
+
+使い方: python benchmarks/export_modes.py [ページ数] [画質設定]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_export import export_pdf  # noqa: E402
+from page_store import PageStore  # noqa: E402
+from pdf_writer import page_layout  # noqa: E402
+from sample_pages import make_text_page  # noqa: E402
+
+
+def main():
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    quality_scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.5
+
+    store = PageStore()
+    try:
+        for i in range(page_count):
+            store.append(make_text_page(i))
+        paths = [store.entry(page_id).path for page_id in store.page_ids()]
+
+        print(f"{page_count}ページ, 画質設定 {quality_scale}倍")
+        modes = (("原寸埋め込み", False, False), ("画素拡大", True, False), ("原寸+内容別圧縮", False, True))
+        for label, upscale, auto_encoding in modes:
+            scale_factor, resolution = page_layout(quality_scale, upscale)
+            fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+            os.close(fd)
+            start = time.perf_counter()
+            export_pdf(paths, pdf_path, scale_factor=scale_factor, resolution=resolution, auto_encoding=auto_encoding)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(pdf_path)
+            os.remove(pdf_path)
+            print(f"  {label}: {elapsed:.2f}秒, {size / 1024 / 1024:.2f} MB")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""ベンチマーク用の合成ページ（文字・漫画・写真）を生成する"""
+import random
+
+from PIL import Image, ImageDraw, ImageFilter
+
+PAGE_KINDS = ("text", "manga", "photo")
+
+
+def make_text_page(seed, size=(900, 1300)):
+    """文字組みを模した合成ページを生成する"""
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, (250, 250, 246))
+    draw = ImageDraw.Draw(img)
+    y = 80
+    while y < size[1] - 80:
+        x = 70
+        while x < size[0] - 70:
+            w = rng.randint(8, 18)
+            draw.rectangle([x, y, x + w, y + 16], fill=(30, 30, 30))
+            x += w + 4
+        y += 30 if rng.random() > 0.1 else 60
+    # アンチエイリアスされた文字に近づける
+    return img.filter(ImageFilter.GaussianBlur(0.6))
+
+
+def make_manga_page(seed, size=(900, 1300)):
+    """コマ割り・スクリーントーン・吹き出しのある白黒の漫画ページを生成する"""
+    rng = random.Random(seed)
+    width, height = size
+    img = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    margin = width // 15
+    rows = rng.randint(3, 4)
+    row_height = (height - margin * 2) // rows
+    for row in range(rows):
+        top = margin + row * row_height
+        split = rng.randint(width // 3, width * 2 // 3)
+        for left, right in ((margin, split - 6), (split + 6, width - margin)):
+            box = [left, top + 6, right, top + row_height - 6]
+            # スクリーントーン（網点）
+            step = rng.choice((6, 8, 10))
+            for y in range(box[1] + step, box[3], step):
+                for x in range(box[0] + step, box[2], step):
+                    if rng.random() < 0.5:
+                        draw.ellipse([x - 1, y - 1, x + 1, y + 1], fill=(90, 90, 90))
+            # 人物や背景の線画
+            for _ in range(rng.randint(4, 10)):
+                points = [(rng.randint(box[0], box[2]), rng.randint(box[1], box[3])) for _ in range(4)]
+                draw.line(points, fill=(0, 0, 0), width=rng.randint(1, 3))
+            # 吹き出しと文字
+            bx, by = rng.randint(box[0], max(box[0], box[2] - 120)), rng.randint(box[1], max(box[1], box[3] - 90))
+            draw.ellipse([bx, by, bx + 110, by + 80], fill=(255, 255, 255), outline=(0, 0, 0), width=2)
+            for line in range(3):
+                draw.rectangle([bx + 30 + line * 20, by + 15, bx + 38 + line * 20, by + 65], fill=(20, 20, 20))
+            draw.rectangle(box, outline=(0, 0, 0), width=3)
+    return img.filter(ImageFilter.GaussianBlur(0.5))
+
+
+def make_photo_page(seed, size=(900, 1300)):
+    """グラデーションとノイズのあるカラー写真風のページを生成する"""
+    rng = random.Random(seed)
+    width, height = size
+    base = Image.linear_gradient("L").resize(size)
+    colors = [tuple(rng.randint(0, 255) for _ in range(3)) for _ in range(2)]
+    img = Image.composite(Image.new("RGB", size, colors[0]), Image.new("RGB", size, colors[1]), base)
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randint(0, width), rng.randint(0, height)
+        r = rng.randint(width // 20, width // 5)
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    img = img.filter(ImageFilter.GaussianBlur(width / 100))
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    return Image.blend(img, noise, 0.15)
+
+
+def make_page(kind, seed, size):
+    return {"text": make_text_page, "manga": make_manga_page, "photo": make_photo_page}[kind](seed, size)
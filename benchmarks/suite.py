@@ -0,0 +1,201 @@
+"""撮影後処理・格納・サムネイル/プレビュー生成・PDF出力の各ステージを計測する
+
+合成した文字・漫画・写真ページを複数の解像度で用意し、実際の処理経路を通して
+ステージごとの処理時間とスループット、ピークメモリ(RSS)、出力サイズをJSONに書き出す。
+各ケースは子プロセスで実行するので、ピークメモリはケースごとの値になる。
+画面は使わないので、ディスプレイのないLinuxでも実行できる。
+
+使い方:
+  python benchmarks/suite.py --output results.json
+  python benchmarks/suite.py --pages 10 --kinds text manga --sizes 900x1300 --compare old.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import PIL  # noqa: E402
+
+from capture_session import CaptureSession  # noqa: E402
+from page_export import create_exporter, export_pages, export_pdf  # noqa: E402
+from page_render import render_preview, render_thumbnail  # noqa: E402
+from page_store import PageStore  # noqa: E402
+from pdf_writer import page_layout  # noqa: E402
+from sample_pages import PAGE_KINDS, make_page  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = ("900x1300", "1200x1600", "1600x2400")
+# 編集画面のプレビュー枠のおおよその大きさ
+PREVIEW_FRAME = (640, 620)
+STAGES = ("process", "store", "thumbnail", "preview_fast", "preview", "export", "export_cbz", "export_tiff")
+
+
+def peak_rss_mb(who):
+    if resource is None:
+        return None
+    # Linuxではキロバイト、macOSではバイト単位
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def run_case(kind, size, pages, quality_scale):
+    """1ケース分（1種類・1解像度）を計測する（子プロセスで実行される）"""
+    timings = dict.fromkeys(STAGES, 0.0)
+    store = PageStore()
+    # 撮影時と同じ後処理（鮮明化・白黒判定・ハッシュ・PNGエンコード）を通す
+    session = CaptureSession(store, None, (0, 0) + size, (0, 0), pages, enhance=True)
+    try:
+        for i in range(pages):
+            img = make_page(kind, i, size)
+            start = time.perf_counter()
+            encoded, _ = session.process_capture((img, True, None))
+            timings["process"] += time.perf_counter() - start
+            start = time.perf_counter()
+            for data, page_size, mode, _ in encoded:
+                store.append_encoded(data, page_size, mode)
+            timings["store"] += time.perf_counter() - start
+
+        page_ids = store.page_ids()
+        store_bytes = sum(os.path.getsize(store.entry(page_id).path) for page_id in page_ids)
+        for page_id in page_ids:
+            start = time.perf_counter()
+            render_thumbnail(store.get(page_id))
+            timings["thumbnail"] += time.perf_counter() - start
+        for page_id in page_ids:
+            img = store.get(page_id)
+            start = time.perf_counter()
+            render_preview(img, PREVIEW_FRAME, fast=True)
+            timings["preview_fast"] += time.perf_counter() - start
+            start = time.perf_counter()
+            render_preview(img, PREVIEW_FRAME)
+            timings["preview"] += time.perf_counter() - start
+
+        scale_factor, resolution = page_layout(quality_scale)
+        pdf_path = os.path.join(store.directory, "benchmark.pdf")
+        start = time.perf_counter()
+        kinds = export_pdf([store.entry(page_id).path for page_id in page_ids], pdf_path,
+                           scale_factor=scale_factor, resolution=resolution, auto_encoding=True)
+        timings["export"] = time.perf_counter() - start
+        output_bytes = os.path.getsize(pdf_path)
+        # PDF以外の形式（CBZはページのPNGをそのまま格納、TIFFはページごとに再圧縮）
+        for stage, name, extension in (("export_cbz", "cbz", ".cbz"), ("export_tiff", "tiff", ".tif")):
+            start = time.perf_counter()
+            export_pages([store.entry(page_id).path for page_id in page_ids],
+                         create_exporter(name, os.path.join(store.directory, "benchmark" + extension),
+                                         resolution=resolution))
+            timings[stage] = time.perf_counter() - start
+    finally:
+        store.close()
+
+    return {
+        "kind": kind,
+        "size": list(size),
+        "pages": pages,
+        "stages": {
+            stage: {"seconds": round(seconds, 4), "pages_per_second": round(pages / seconds, 2) if seconds else None}
+            for stage, seconds in timings.items()
+        },
+        "store_bytes": store_bytes,
+        "output_bytes": output_bytes,
+        "encodings": {kind: kinds.count(kind) for kind in sorted(set(kinds))},
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        "export_workers_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """前回の結果と比べて、ステージごとの速度比を表示する"""
+    before = {(case["kind"], tuple(case["size"])): case for case in previous["cases"]}
+    print(f"比較: {previous.get('revision')} → {results.get('revision')}（1より大きいほど高速化）")
+    for case in results["cases"]:
+        old = before.get((case["kind"], tuple(case["size"])))
+        if old is None:
+            continue
+        ratios = []
+        for stage in STAGES:
+            new_speed = case["stages"][stage]["pages_per_second"]
+            old_speed = old["stages"].get(stage, {}).get("pages_per_second")
+            if new_speed and old_speed:
+                ratios.append(f"{stage} {new_speed / old_speed:.2f}")
+        print(f"  {case['kind']} {case['size'][0]}x{case['size'][1]}: {', '.join(ratios)}")
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="処理ステージごとのベンチマーク")
+    parser.add_argument("--pages", type=int, default=20, help="1ケースあたりのページ数")
+    parser.add_argument("--kinds", nargs="+", choices=PAGE_KINDS, default=list(PAGE_KINDS))
+    parser.add_argument("--sizes", nargs="+", default=list(DEFAULT_SIZES), help="幅x高さ")
+    parser.add_argument("--quality", type=float, default=1.5, help="PDF品質設定（倍率）")
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル")
+    parser.add_argument("--compare", help="比較する前回の結果のJSON")
+    parser.add_argument("--case", nargs=2, metavar=("KIND", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # 子プロセス: 処理中の出力は標準エラーに回し、標準出力には結果だけを書く
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run_case(args.case[0], parse_size(args.case[1]), args.pages, args.quality)
+        print(json.dumps(result))
+        return
+
+    results = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cases": [],
+    }
+    for kind in args.kinds:
+        for size in args.sizes:
+            command = [sys.executable, os.path.abspath(__file__), "--case", kind, size,
+                       "--pages", str(args.pages), "--quality", str(args.quality)]
+            # 各ケースの途中経過（標準エラー）は失敗したときだけ表示する
+            completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if completed.returncode != 0:
+                sys.stderr.write(completed.stderr)
+                sys.exit(f"{kind} {size} の計測に失敗しました（終了コード {completed.returncode}）")
+            case = json.loads(completed.stdout)
+            results["cases"].append(case)
+            stages = case["stages"]
+            print(f"{kind} {size}: 後処理 {stages['process']['pages_per_second']}枚/秒, "
+                  f"サムネイル {stages['thumbnail']['pages_per_second']}枚/秒, "
+                  f"PDF出力 {stages['export']['pages_per_second']}枚/秒, "
+                  f"PDF {case['output_bytes'] / 1024 / 1024:.2f} MB, ピークメモリ {case['peak_rss_mb']} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,483 @@
+"""スクリーンキャプチャのバックエンド
+
+バックエンドはopen()からclose()まで資源（デバイスコンテキストや共有メモリ）を
+保持し続け、撮影ごとに作り直さない。register_backend()で登録したものを
+create_backend()で名前から生成する。
+"""
+import ctypes
+import ctypes.util
+import importlib.util
+import os
+import platform
+import random
+import time
+
+from PIL import Image, ImageDraw
+
+BACKENDS = {}
+
+
+def register_backend(name):
+    """バックエンドクラスを名前で登録するデコレータ"""
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def available_backends():
+    """この環境で使えるバックエンド名の一覧"""
+    return [name for name, cls in BACKENDS.items() if cls.is_available()]
+
+
+def default_backend_name():
+    for name in ("gdi", "x11shm", "pyautogui"):
+        if name in BACKENDS and BACKENDS[name].is_available():
+            return name
+    return "pyautogui"
+
+
+def create_backend(name=None, **options):
+    name = name or default_backend_name()
+    if name not in BACKENDS:
+        raise ValueError(f"不明なキャプチャ方式です: {name}")
+    return BACKENDS[name](**options)
+
+
+class CaptureBackend:
+    """キャプチャバックエンドの基底クラス
+
+    needs_enhanceがTrueのバックエンドは、取得後に品質向上処理を行う。
+    """
+    name = None
+    needs_enhance = False
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def open(self):
+        """撮影開始前に資源を確保する"""
+
+    def grab(self, x, y, width, height):
+        """指定範囲を撮影してRGBのPIL画像を返す"""
+        raise NotImplementedError
+
+    def click(self, position):
+        """ページめくりのためにクリックする"""
+        import pyautogui
+        pyautogui.click(position)
+
+    def close(self):
+        """確保した資源を解放する"""
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+@register_backend("pyautogui")
+class PyAutoGuiBackend(CaptureBackend):
+    """pyautoguiによる汎用のキャプチャ（取得後に品質向上処理を行う）"""
+    needs_enhance = True
+
+    @classmethod
+    def is_available(cls):
+        # pyautoguiは読み込むとpymsgbox・mouseinfo経由でtkinterも読み込むので、
+        # 使えるかどうかはパッケージの有無だけで調べ、読み込むのは実際に開いたときにする
+        return importlib.util.find_spec("pyautogui") is not None
+
+    def open(self):
+        import pyautogui  # noqa: F401
+
+    def grab(self, x, y, width, height):
+        import pyautogui
+        return pyautogui.screenshot(region=(x, y, width, height))
+
+
+@register_backend("gdi")
+class GdiBackend(CaptureBackend):
+    """Windows GDIによるキャプチャ。デバイスコンテキストとビットマップを撮影間で使い回す"""
+
+    @classmethod
+    def is_available(cls):
+        if platform.system() != "Windows":
+            return False
+        try:
+            import win32gui  # noqa: F401
+            import win32ui  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self):
+        self._desktop = None
+        self._bitmap = None
+        self._bitmap_size = None
+
+    def open(self):
+        import win32gui
+        import win32ui
+        # デスクトップのデバイスコンテキストを取得
+        self._hdesktop = win32gui.GetDesktopWindow()
+        self._desktop_dc = win32gui.GetWindowDC(self._hdesktop)
+        self._img_dc = win32ui.CreateDCFromHandle(self._desktop_dc)
+        self._mem_dc = self._img_dc.CreateCompatibleDC()
+        self._bitmap = None
+        self._desktop = True
+
+    def _ensure_bitmap(self, width, height):
+        import win32con
+        import win32gui
+        import win32ui
+        if self._bitmap_size == (width, height):
+            return
+        # ビットマップを作成（サイズが変わらない限り再利用する）
+        previous = self._bitmap
+        self._bitmap = win32ui.CreateBitmap()
+        self._bitmap.CreateCompatibleBitmap(self._img_dc, width, height)
+        self._mem_dc.SelectObject(self._bitmap)
+        if previous is not None:
+            win32gui.DeleteObject(previous.GetHandle())
+        # 高品質でコピー（HALFTONE モードで品質向上）
+        self._mem_dc.SetStretchBltMode(win32con.HALFTONE)
+        self._bitmap_size = (width, height)
+
+    def grab(self, x, y, width, height):
+        import win32con
+        if self._desktop is None:
+            self.open()
+        self._ensure_bitmap(width, height)
+        self._mem_dc.BitBlt((0, 0), (width, height), self._img_dc, (x, y), win32con.SRCCOPY)
+        # ビットマップデータを取得してPILイメージに変換
+        bmpinfo = self._bitmap.GetInfo()
+        bmpstr = self._bitmap.GetBitmapBits(True)
+        return Image.frombuffer("RGB", (bmpinfo["bmWidth"], bmpinfo["bmHeight"]), bmpstr, "raw", "BGRX", 0, 1)
+
+    def click(self, position):
+        # pyautogui（とその依存のTk）を読み込まずにWin32 APIで直接クリックする
+        import win32api
+        import win32con
+        win32api.SetCursorPos(tuple(position))
+        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0)
+        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0)
+
+    def close(self):
+        import win32gui
+        if self._desktop is None:
+            return
+        # リソースを解放
+        if self._bitmap is not None:
+            win32gui.DeleteObject(self._bitmap.GetHandle())
+        self._mem_dc.DeleteDC()
+        self._img_dc.DeleteDC()
+        win32gui.ReleaseDC(self._hdesktop, self._desktop_dc)
+        self._desktop = None
+        self._bitmap_size = None
+
+
+class _XImage(ctypes.Structure):
+    _fields_ = [
+        ("width", ctypes.c_int),
+        ("height", ctypes.c_int),
+        ("xoffset", ctypes.c_int),
+        ("format", ctypes.c_int),
+        ("data", ctypes.c_void_p),
+        ("byte_order", ctypes.c_int),
+        ("bitmap_unit", ctypes.c_int),
+        ("bitmap_bit_order", ctypes.c_int),
+        ("bitmap_pad", ctypes.c_int),
+        ("depth", ctypes.c_int),
+        ("bytes_per_line", ctypes.c_int),
+        ("bits_per_pixel", ctypes.c_int),
+        ("red_mask", ctypes.c_ulong),
+        ("green_mask", ctypes.c_ulong),
+        ("blue_mask", ctypes.c_ulong),
+        ("obdata", ctypes.c_void_p),
+        ("funcs", ctypes.c_void_p * 6),
+    ]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ("shmseg", ctypes.c_ulong),
+        ("shmid", ctypes.c_int),
+        ("shmaddr", ctypes.c_void_p),
+        ("readOnly", ctypes.c_int),
+    ]
+
+
+class _XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("display", ctypes.c_void_p),
+        ("resourceid", ctypes.c_ulong),
+        ("serial", ctypes.c_ulong),
+        ("error_code", ctypes.c_ubyte),
+        ("request_code", ctypes.c_ubyte),
+        ("minor_code", ctypes.c_ubyte),
+    ]
+
+
+_XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(_XErrorEvent))
+
+
+@register_backend("x11shm")
+class X11ShmBackend(CaptureBackend):
+    """X11のMIT-SHM拡張によるキャプチャ。共有メモリの画像バッファを撮影間で使い回す"""
+
+    ZPIXMAP = 2
+    LSB_FIRST = 0
+    IPC_PRIVATE = 0
+    IPC_CREAT = 0o1000
+    IPC_RMID = 0
+
+    @classmethod
+    def is_available(cls):
+        if not platform.system() == "Linux" or not os.environ.get("DISPLAY"):
+            return False
+        return bool(ctypes.util.find_library("X11") and ctypes.util.find_library("Xext"))
+
+    def __init__(self):
+        self._display = None
+        self._image = None
+        self._image_size = None
+        self._xtst = None
+        self._error_code = None
+        self._error_handler = None
+        self._previous_handler = None
+
+    def open(self):
+        xlib = ctypes.CDLL(ctypes.util.find_library("X11"))
+        xext = ctypes.CDLL(ctypes.util.find_library("Xext"))
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        xlib.XOpenDisplay.restype = ctypes.c_void_p
+        xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        xlib.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        xlib.XRootWindow.restype = ctypes.c_ulong
+        xlib.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDefaultVisual.restype = ctypes.c_void_p
+        xlib.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XFree.argtypes = [ctypes.c_void_p]
+        xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xlib.XSetErrorHandler.restype = ctypes.c_void_p
+        xlib.XSetErrorHandler.argtypes = [ctypes.c_void_p]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p,
+            ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint,
+        ]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage), ctypes.c_int, ctypes.c_int, ctypes.c_ulong,
+        ]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+        self._xlib, self._xext, self._libc = xlib, xext, libc
+
+        self._display = xlib.XOpenDisplay(None)
+        if not self._display:
+            raise RuntimeError("Xディスプレイに接続できません")
+        if not xext.XShmQueryExtension(self._display):
+            xlib.XCloseDisplay(self._display)
+            self._display = None
+            raise RuntimeError("MIT-SHM拡張が利用できません")
+        # Xlibの既定のエラーハンドラはプロセスを終了させるので、エラーコードを記録するだけの
+        # ハンドラに置き換え、呼び出し側でOSErrorにする（pyautoguiへの切り替えができるように）
+        self._error_code = None
+        self._error_handler = _XErrorHandler(self._on_x_error)
+        self._previous_handler = xlib.XSetErrorHandler(ctypes.cast(self._error_handler, ctypes.c_void_p))
+        screen = xlib.XDefaultScreen(self._display)
+        self._root = xlib.XRootWindow(self._display, screen)
+        self._visual = xlib.XDefaultVisual(self._display, screen)
+        self._depth = xlib.XDefaultDepth(self._display, screen)
+        # クリックにはXTest拡張を使う（無ければpyautoguiで代用する）
+        self._xtst = None
+        if ctypes.util.find_library("Xtst"):
+            xtst = ctypes.CDLL(ctypes.util.find_library("Xtst"))
+            xtst.XTestFakeMotionEvent.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+            xtst.XTestFakeButtonEvent.argtypes = [ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong]
+            xlib.XFlush.argtypes = [ctypes.c_void_p]
+            self._xtst = xtst
+
+    def _on_x_error(self, display, event):
+        self._error_code = event.contents.error_code
+        return 0
+
+    def _take_x_error(self):
+        """要求をサーバーまで送って結果を待ち、その間に記録したXエラーのコードを返す"""
+        self._xlib.XSync(self._display, 0)
+        error_code, self._error_code = self._error_code, None
+        return error_code
+
+    def _ensure_image(self, width, height):
+        if self._image_size == (width, height):
+            return
+        self._release_image()
+        shminfo = _XShmSegmentInfo()
+        image = self._xext.XShmCreateImage(
+            self._display, self._visual, self._depth, self.ZPIXMAP, None, ctypes.byref(shminfo), width, height
+        )
+        if not image:
+            raise OSError("XShmCreateImageに失敗しました")
+        contents = image.contents
+        # grab()は1画素4バイトのBGRXとして読むので、それ以外の画面形式はpyautoguiに任せる
+        if contents.bits_per_pixel != 32 or contents.byte_order != self.LSB_FIRST or contents.blue_mask != 0xFF:
+            bits_per_pixel = contents.bits_per_pixel
+            self._xlib.XFree(image)
+            raise OSError(f"対応していない画面形式です（{bits_per_pixel}ビット/画素）")
+        size = contents.bytes_per_line * height
+        shminfo.shmid = self._libc.shmget(self.IPC_PRIVATE, size, self.IPC_CREAT | 0o600)
+        if shminfo.shmid < 0:
+            self._xlib.XFree(image)
+            raise OSError(ctypes.get_errno(), "shmgetに失敗しました")
+        shminfo.shmaddr = self._libc.shmat(shminfo.shmid, None, 0)
+        if shminfo.shmaddr in (None, ctypes.c_void_p(-1).value):
+            errno = ctypes.get_errno()
+            self._libc.shmctl(shminfo.shmid, self.IPC_RMID, None)
+            self._xlib.XFree(image)
+            raise OSError(errno, "shmatに失敗しました")
+        shminfo.readOnly = 0
+        contents.data = shminfo.shmaddr
+        attached = self._xext.XShmAttach(self._display, ctypes.byref(shminfo))
+        error_code = self._take_x_error()
+        # プロセス終了時に確実に解放されるよう、アタッチ後すぐに削除予約する
+        self._libc.shmctl(shminfo.shmid, self.IPC_RMID, None)
+        if not attached or error_code is not None:
+            self._libc.shmdt(shminfo.shmaddr)
+            contents.data = None
+            self._xlib.XFree(image)
+            raise OSError(f"XShmAttachに失敗しました（Xエラー {error_code}）")
+        self._image, self._shminfo, self._image_size = image, shminfo, (width, height)
+        self._buffer = (ctypes.c_char * size).from_address(shminfo.shmaddr)
+
+    def _release_image(self):
+        if self._image is None:
+            return
+        self._xext.XShmDetach(self._display, ctypes.byref(self._shminfo))
+        # 解放時のエラーは無視する（次の要求のエラーと取り違えないよう記録も消す）
+        self._take_x_error()
+        self._libc.shmdt(self._shminfo.shmaddr)
+        self._image.contents.data = None
+        self._xlib.XFree(self._image)
+        self._image = None
+        self._image_size = None
+        self._buffer = None
+
+    def grab(self, x, y, width, height):
+        if self._display is None:
+            self.open()
+        self._ensure_image(width, height)
+        # 解像度の変更で範囲が画面からはみ出した場合などはBadMatchになる
+        succeeded = self._xext.XShmGetImage(self._display, self._root, self._image, x, y, 0xFFFFFFFF)
+        error_code = self._take_x_error()
+        if not succeeded or error_code is not None:
+            raise OSError(f"XShmGetImageに失敗しました（Xエラー {error_code}）")
+        stride = self._image.contents.bytes_per_line
+        # 共有バッファからRGB画像へ1回だけコピーする
+        return Image.frombuffer("RGB", (width, height), self._buffer, "raw", "BGRX", stride, 1)
+
+    def click(self, position):
+        if self._display is None or self._xtst is None:
+            return super().click(position)
+        x, y = position
+        self._xtst.XTestFakeMotionEvent(self._display, -1, x, y, 0)
+        self._xtst.XTestFakeButtonEvent(self._display, 1, 1, 0)
+        self._xtst.XTestFakeButtonEvent(self._display, 1, 0, 0)
+        self._xlib.XFlush(self._display)
+
+    def close(self):
+        if self._display is None:
+            return
+        self._release_image()
+        self._xlib.XCloseDisplay(self._display)
+        self._display = None
+        self._xlib.XSetErrorHandler(self._previous_handler)
+        self._error_handler = None
+
+
+@register_backend("synthetic")
+class SyntheticBackend(CaptureBackend):
+    """疑似的な本のページを描画するバックエンド（画面やマウスを使わないテスト・計測用）
+
+    click()で次のページへ進み、turn_delay秒のめくり中は前後のページを
+    重ねた画像を返す。page_count枚目以降は最後のページのままになる。
+    同じseedなら同じページが描画される。
+    spread=Trueなら2ページを左右に並べた見開きを返す。
+    """
+
+    def __init__(self, page_count=30, seed=0, turn_delay=0.0, spread=False):
+        self.page_count = page_count
+        self.seed = seed
+        self.turn_delay = turn_delay
+        self.spread = spread
+        self.current_page = 0
+        self.clicks = 0
+        self._turned_at = None
+        self._cache = {}
+
+    def render_page(self, number, size):
+        """ページ番号から決まる文字組みのページを描画する"""
+        key = (number, size)
+        if key in self._cache:
+            return self._cache[key]
+        width, height = size
+        rng = random.Random(self.seed * 100003 + number)
+        img = Image.new("RGB", size, (250, 250, 246))
+        draw = ImageDraw.Draw(img)
+        margin = max(4, width // 12)
+        line_height = max(6, height // 40)
+        y = margin
+        while y < height - margin - line_height:
+            x = margin
+            if rng.random() < 0.1:
+                y += line_height
+                continue
+            while x < width - margin:
+                w = rng.randint(line_height // 2, line_height)
+                draw.rectangle([x, y, min(x + w, width - margin), y + line_height * 2 // 3], fill=(30, 30, 30))
+                x += w + max(2, line_height // 4)
+            y += line_height
+        draw.text((width // 2, height - margin // 2), str(number + 1), fill=(0, 0, 0))
+        # 直近の数ページだけ保持する
+        if len(self._cache) > 4:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[key] = img
+        return img
+
+    def render_view(self, number, size):
+        """画面に表示される1画面分（見開きなら2ページ）を描画する"""
+        if not self.spread:
+            return self.render_page(number, size)
+        width, height = size
+        view = Image.new("RGB", size, (250, 250, 246))
+        view.paste(self.render_page(number * 2, (width // 2, height)), (0, 0))
+        view.paste(self.render_page(number * 2 + 1, (width - width // 2, height)), (width // 2, 0))
+        return view
+
+    def grab(self, x, y, width, height):
+        size = (width, height)
+        page = self.render_view(self.current_page, size)
+        if self._turned_at is not None and time.monotonic() - self._turned_at < self.turn_delay:
+            previous = self.render_view(max(0, self.current_page - 1), size)
+            return Image.blend(previous, page, 0.5)
+        return page.copy()
+
+    def click(self, position):
+        self.clicks += 1
+        if self.current_page < self.page_count - 1:
+            self.current_page += 1
+        self._turned_at = time.monotonic()
@@ -0,0 +1,131 @@
+"""撮影ループを「撮影+クリック」と「後処理+格納」に分けるパイプライン"""
+import queue
+import threading
+import time
+
+
+class PipelineStats:
+    """各ステージの処理枚数と所要時間を集計する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.perf_counter()
+        self.counts = {}
+        self.seconds = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def pages_per_minute(self, stage):
+        """開始からの経過時間あたりの処理枚数（枚/分）"""
+        elapsed = time.perf_counter() - self.started_at
+        with self._lock:
+            count = self.counts.get(stage, 0)
+        return count * 60.0 / elapsed if elapsed > 0 else 0.0
+
+    def average_seconds(self, stage):
+        with self._lock:
+            count = self.counts.get(stage, 0)
+            return self.seconds.get(stage, 0.0) / count if count else 0.0
+
+
+class CapturePipeline:
+    """撮影した生画像を有界キュー経由でワーカーに渡し、結果をページ順にsinkへ渡す
+
+    - submit()はキューが満杯のときブロックする（バックプレッシャー）
+    - ワーカーの完了順に関わらず、sinkは必ずページ番号順に呼ばれる
+    - close()はキューに残っている分を処理し終えてからワーカーを終了する
+    - statsを渡すとそこに各ステージの時間を記録する（省略時はPipelineStatsを作る）
+    - controllerを渡すとエラーを"error"イベントで通知し、格納に失敗したら撮影を止める
+    """
+
+    def __init__(self, process, sink, workers=2, max_queue=8, first_index=0, stats=None, controller=None):
+        self.process = process
+        self.sink = sink
+        self.controller = controller
+        self.max_queue = max_queue
+        self.stats = stats or PipelineStats()
+        self.error = None
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._results = {}
+        self._next_index = first_index
+        self._results_lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"capture-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, index, item):
+        """撮影したページを投入する（indexはfirst_indexからの連番）"""
+        self._queue.put((index, item))
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            index, item = task
+            try:
+                start = time.perf_counter()
+                result = self.process(item)
+                self.stats.record("process", time.perf_counter() - start)
+            except Exception as e:
+                self._report(e, f"ページ {index + 1} の後処理エラー: {e}")
+                result = None
+            with self._results_lock:
+                self._results[index] = result
+            self._commit_ready()
+
+    def _report(self, error, message, stop=False):
+        print(message)
+        self.error = error
+        if self.controller is not None:
+            self.controller.post("error", message)
+            if stop:
+                self.controller.stop()
+
+    def _commit_ready(self):
+        # 次に格納すべきページが揃っている間、順番にsinkへ渡す
+        while True:
+            if not self._commit_lock.acquire(blocking=False):
+                return
+            try:
+                while True:
+                    with self._results_lock:
+                        if self._next_index not in self._results:
+                            break
+                        result = self._results.pop(self._next_index)
+                        index = self._next_index
+                        self._next_index += 1
+                    if result is None:
+                        continue
+                    try:
+                        start = time.perf_counter()
+                        self.sink(index, result)
+                        self.stats.record("store", time.perf_counter() - start)
+                    except Exception as e:
+                        # 格納できなければ以降のページも失われるので、撮影を続けない
+                        self._report(e, f"ページ {index + 1} の格納エラー: {e}", stop=True)
+            finally:
+                self._commit_lock.release()
+            # ロック解放後に他のワーカーが結果を置いた場合は自分で続きを格納する
+            with self._results_lock:
+                if self._next_index not in self._results:
+                    return
+
+    def close(self):
+        """キューに残っているページを処理し終えてからワーカーを停止する"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,291 @@
+"""撮影ループ（撮影・ページめくり・後処理・格納）をTkに依存せずに実行する
+
+GUI（main.py）とヘッドレス実行（batch_capture.py）の両方から使う。
+"""
+import hashlib
+import time
+
+from capture_backends import create_backend
+from capture_pipeline import CapturePipeline
+from job_controller import JobController
+from page_analysis import AutoTrimmer, DuplicateDetector, SpreadSplitter, compact_page, dhash
+from page_enhance import ENHANCE_CONTRAST, ENHANCE_SHARPNESS, enhance_page
+from page_turn import PageTurnDetector
+from telemetry import NULL_TELEMETRY
+
+
+def enhance_screenshot(screenshot, contrast=ENHANCE_CONTRAST, sharpness=ENHANCE_SHARPNESS):
+    """スクリーンショット後の品質向上処理（コントラストとシャープネスを1パスで適用）"""
+    screenshot = enhance_page(screenshot, contrast, sharpness)
+    print(f"スクリーンショット品質向上処理完了: {screenshot.size}")
+    return screenshot
+
+
+class CaptureSession:
+    """1冊分の撮影を行う
+
+    run()は撮影スレッドで呼ぶ。停止・一時停止はcontroller（JobController）で行い、
+    待機中でもすぐに反映される。ページ番号0は位置合わせ用の1枚目で、ストアには格納しない。
+    enhanceがNoneのときはバックエンドの指定（needs_enhance）に従い、
+    True/Falseのときはキャプチャ方式に関わらず品質向上処理を行う/行わない。
+    撮影するたびにcontrollerへ ("page", 撮影済み枚数) を通知する。
+    telemetryを渡すと待機・クリック・撮影・後処理の各ステージの時間を記録する。
+    trimに"book"（本全体で共通の範囲）か"page"（ページごと）を渡すと、格納する前に
+    撮影範囲の余白を切り抜く（以降の鮮明化・エンコード・出力はすべて小さい画像で行う）。
+    split_spreadsがTrueなら見開きを左右のページに分割して格納する（right_to_leftで右ページが先）。
+    重複・終端の判定は分割前の撮影画像の単位で行う。
+    """
+
+    def __init__(self, page_store, journal, area, click_position, count,
+                 backend=None, backend_options=None, wait_time=0.5, adaptive_wait=False,
+                 skip_duplicates=True, stop_after_duplicates=3,
+                 compact=True, bilevel=False, enhance=None, contrast=ENHANCE_CONTRAST,
+                 sharpness=ENHANCE_SHARPNESS, resume_from=0, controller=None, telemetry=None, trim=None,
+                 split_spreads=False, right_to_left=False):
+        self.page_store = page_store
+        self.journal = journal
+        self.area = tuple(area)
+        self.click_position = tuple(click_position)
+        self.count = count
+        self.backend_name = backend
+        self.backend_options = backend_options or {}
+        self.wait_time = wait_time
+        self.adaptive_wait = adaptive_wait
+        self.skip_duplicates = skip_duplicates
+        self.compact = compact
+        self.bilevel = bilevel
+        self.enhance = enhance
+        self.contrast = contrast
+        self.sharpness = sharpness
+        self.resume_from = resume_from
+        self.controller = controller or JobController()
+        self.telemetry = telemetry or NULL_TELEMETRY
+        self.last_click = None
+        self.duplicate_detector = DuplicateDetector(stop_after=stop_after_duplicates)
+        # 本全体の範囲は撮影スレッドで最初の数枚から決める。ワーカーは確定まで待つので、
+        # warmupはキューの長さ（8）より小さくしておく
+        self.trimmer = AutoTrimmer(trim, warmup=5) if trim else None
+        self.splitter = SpreadSplitter(right_to_left) if split_spreads else None
+        self.end_of_book = False
+        self.backend = None
+        self.pipeline = None
+
+    @property
+    def is_running(self):
+        return not self.controller.stopped
+
+    def stop(self):
+        self.controller.stop()
+
+    def run(self):
+        """撮影+クリックをこのスレッドで行い、後処理と保存はワーカーに任せる"""
+        self.controller.begin()
+        self.end_of_book = False
+        # キャプチャの資源（DC・共有メモリなど）は撮影の間ずっと開いたままにする
+        self.backend = create_backend(self.backend_name, **self.backend_options)
+        try:
+            self.backend.open()
+        except Exception as e:
+            print(f"{self.backend.name}を開けません（{e}）。pyautoguiを使用します。")
+            self.backend = create_backend("pyautogui")
+        print(f"キャプチャ方式: {self.backend.name}")
+        first_page = self.resume_from + 1
+        self.pipeline = CapturePipeline(self.process_capture, self.store_capture, workers=2, max_queue=8,
+                                        first_index=self.resume_from,
+                                        stats=self.telemetry if self.telemetry.enabled else None,
+                                        controller=self.controller)
+        telemetry = self.telemetry
+        last_grab = None
+        detector = PageTurnDetector(self.grab_probe)
+        max_pages = self.count + 1
+        try:
+            if self.resume_from:
+                # 再開時は最後に撮影したページが表示されているので、先にページをめくる
+                self.turn_page(detector, first_page - 1)
+            for page_count in range(first_page, max_pages + 1):
+                # 一時停止中はここで待つ
+                if not self.controller.checkpoint():
+                    break
+
+                x1, y1, x2, y2 = self.area
+                # 最高解像度でスクリーンショットを取得（品質向上処理はワーカー側で実施）
+                start = time.perf_counter()
+                if self.last_click is not None:
+                    telemetry.record("click_to_capture", start - self.last_click, page_count)
+                if last_grab is not None:
+                    telemetry.record("page", start - last_grab, page_count)
+                last_grab = start
+                img = self.grab(x1, y1, x2 - x1, y2 - y1)
+                self.pipeline.stats.record("capture", time.perf_counter() - start)
+                screenshot = (img, self.needs_enhance(), self.sample_trim(img, page_count))
+                del img
+                # キューが満杯の場合はワーカーが追いつくまで待つ
+                self.pipeline.submit(page_count - 1, screenshot)
+                del screenshot
+                self.controller.post("page", max(0, page_count - 1))
+
+                if page_count < max_pages:
+                    self.turn_page(detector, page_count)
+        finally:
+            if self.trimmer is not None:
+                # 数枚で終わった場合も、待っているワーカーを進められるよう範囲を確定する
+                self.trimmer.finalize()
+            self.backend.close()
+            self.backend = None
+            # 停止後もキューに残っているページは処理・保存してから戻る
+            self.controller.drain()
+            self.pipeline.close()
+            self.controller.finish()
+
+    def needs_enhance(self):
+        return self.backend.needs_enhance if self.enhance is None else self.enhance
+
+    def sample_trim(self, img, page_count):
+        """本全体の余白除去範囲が決まるまで、撮影したページの内容範囲を集める"""
+        trimmer = self.trimmer
+        if trimmer is None or trimmer.ready:
+            return None
+        start = time.perf_counter()
+        page_box = trimmer.observe(img)
+        trimmer.add_sample(img.size, page_box)
+        self.telemetry.record("trim", time.perf_counter() - start, page_count)
+        return page_box
+
+    def trim_capture(self, screenshot, page_box):
+        """余白を切り抜く（page_boxは撮影スレッドで求めた内容範囲。なければここで求める）"""
+        trimmer = self.trimmer
+        if page_box is None:
+            page_box = trimmer.observe(screenshot)
+        box = trimmer.crop_box(screenshot.size, page_box)
+        return screenshot.crop(box) if box else screenshot
+
+    def process_capture(self, item):
+        """ワーカースレッドで撮影画像の余白除去・品質向上処理とPNGエンコードを行う"""
+        screenshot, needs_enhance, page_box = item
+        telemetry = self.telemetry
+        if self.trimmer is not None:
+            # 本全体の範囲が決まるまで待つ（待ち時間は計測に含めない）
+            self.trimmer.wait()
+            start = time.perf_counter()
+            screenshot = self.trim_capture(screenshot, page_box)
+            telemetry.record("trim", time.perf_counter() - start)
+        start = time.perf_counter()
+        if needs_enhance:
+            screenshot = enhance_screenshot(screenshot, self.contrast, self.sharpness)
+            telemetry.record("enhance", time.perf_counter() - start)
+            start = time.perf_counter()
+        if self.compact:
+            # モノクロのページはL（または2値）で保持してメモリとディスクを節約する
+            screenshot = compact_page(screenshot, bilevel=self.bilevel)
+            telemetry.record("compact", time.perf_counter() - start)
+            start = time.perf_counter()
+        page_hash = dhash(screenshot)
+        telemetry.record("hash", time.perf_counter() - start)
+        if self.splitter is not None:
+            start = time.perf_counter()
+            # 見開きでなければ撮影画像がそのまま1ページになる
+            pages = self.splitter.split(screenshot)
+            del screenshot
+            telemetry.record("split", time.perf_counter() - start)
+        else:
+            pages = [screenshot]
+            del screenshot
+        encoded = []
+        # 分割したページは1枚ずつ切り出してエンコードする（同時に持つのは半ページ分だけ）
+        for page in pages:
+            start = time.perf_counter()
+            data = self.page_store.encode(page)
+            telemetry.record("encode", time.perf_counter() - start)
+            encoded.append((data, page.size, page.mode, hashlib.sha1(data).hexdigest()))
+            del page
+        return encoded, page_hash
+
+    def store_capture(self, index, result):
+        """エンコード済みのページをページ順にストアへ書き出す（重複ページは破棄する）
+
+        見開きを分割した場合は、1回の撮影で読む順に複数のページを格納する。
+        """
+        encoded, page_hash = result
+        if index == 0:
+            # 最初の1枚は編集・出力の対象外
+            return
+        if self.end_of_book:
+            # 終端と判断する前に撮影済みだったページは最後のページの繰り返しなので格納しない
+            return
+        detector = self.duplicate_detector
+        if self.skip_duplicates:
+            duplicate = detector.check(page_hash)
+        else:
+            # 重複ページを残す場合も、本の終端の検出は行う
+            detector.observe(page_hash)
+            duplicate = False
+        if duplicate:
+            print(f"ページ {index}: 直前のページと重複しているため除外")
+        if detector.end_reached and self.is_running:
+            print("同じページが続いたため、本の終端と判断して撮影を終了します")
+            self.end_of_book = True
+            self.controller.stop()
+        if duplicate:
+            return
+        for data, size, mode, digest in encoded:
+            page_id = self.page_store.append_encoded(data, size, mode)
+            # ジャーナルに記録しておき、クラッシュ後もこのページから再開できるようにする
+            self.journal.record_page(index, page_id, self.page_store.entry(page_id), digest,
+                                     self.area, self.click_position)
+
+    def turn_page(self, detector, page_count):
+        if self.adaptive_wait:
+            self.turn_page_adaptive(detector, page_count)
+        else:
+            wait = 1.0 if page_count == 1 else self.wait_time
+            start = time.perf_counter()
+            # 停止されると待機の途中でも戻る
+            waited = self.controller.wait(wait)
+            self.telemetry.record("wait", time.perf_counter() - start, page_count)
+            if waited and self.controller.checkpoint():
+                self.click(page_count)
+
+    def click(self, page_count):
+        start = time.perf_counter()
+        self.backend.click(self.click_position)
+        self.last_click = time.perf_counter()
+        self.telemetry.record("click", self.last_click - start, page_count)
+
+    def grab(self, x, y, width, height):
+        """撮影方式で画面を取得する（失敗したらpyautoguiに切り替えて撮り直す）
+
+        開けた後でも、画面の解像度変更やセッションの切り替えで撮影できなくなることがある。
+        """
+        try:
+            return self.backend.grab(x, y, width, height)
+        except Exception as e:
+            if self.backend.name == "pyautogui":
+                raise
+            print(f"{self.backend.name}で撮影できません（{e}）。pyautoguiに切り替えます。")
+            try:
+                self.backend.close()
+            except Exception as close_error:
+                print(f"{self.backend.name}の解放に失敗しました: {close_error}")
+            self.backend = create_backend("pyautogui")
+        return self.backend.grab(x, y, width, height)
+
+    def grab_probe(self):
+        """ページめくり検出用の縮小グレースケールフレームを取得"""
+        x1, y1, x2, y2 = self.area
+        frame = self.grab(x1, y1, x2 - x1, y2 - y1)
+        return frame.reduce(4).convert("L")
+
+    def turn_page_adaptive(self, detector, next_page):
+        """クリック後、撮影範囲の変化が収まった時点で戻る（待機時間は上限として扱う）"""
+        if not self.controller.checkpoint():
+            return
+        reference = self.grab_probe()
+        self.click(next_page)
+        settled, elapsed = detector.wait_for_settle(
+            reference, timeout=self.wait_time, should_continue=lambda: self.is_running
+        )
+        self.telemetry.record("wait", elapsed, next_page)
+        if settled:
+            print(f"ページ {next_page}: ページめくり検出 {elapsed:.2f}秒で安定")
+        else:
+            print(f"ページ {next_page}: 安定を検出できず {elapsed:.2f}秒で撮影")
@@ -0,0 +1,110 @@
+"""撮影・出力ジョブの状態管理（停止・一時停止・進捗の受け渡し）
+
+待機はすべてイベントで行うので、stop()は待機中のスレッドをすぐに起こす。
+ワーカースレッドからUIへの通知はpost()でキューに積み、UI側が一定間隔で
+drain_events()して処理する（ワーカーはUIを直接触らない）。
+"""
+import queue
+import threading
+
+IDLE = "idle"
+RUNNING = "running"
+PAUSED = "paused"
+DRAINING = "draining"      # 撮影を終え、キューに残ったページを処理している
+EXPORTING = "exporting"
+
+STATE_LABELS = {
+    IDLE: "待機中",
+    RUNNING: "処理中...",
+    PAUSED: "一時停止中",
+    DRAINING: "残りのページを保存中...",
+    EXPORTING: "PDF保存中...",
+}
+
+
+class JobController:
+    """ジョブの状態遷移と停止・一時停止を管理する（どのスレッドから呼んでもよい）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = IDLE
+        self.stop_event = threading.Event()
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self.events = queue.Queue()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    @property
+    def busy(self):
+        return self.state != IDLE
+
+    def _set_state(self, state):
+        with self._lock:
+            self._state = state
+        self.post("state", state)
+
+    def begin(self, state=RUNNING):
+        """新しいジョブを開始する（前回の停止要求は取り消す）"""
+        self.stop_event.clear()
+        self._resume_event.set()
+        self._set_state(state)
+
+    def drain(self):
+        self._resume_event.set()
+        self._set_state(DRAINING)
+
+    def finish(self):
+        self._resume_event.set()
+        self._set_state(IDLE)
+
+    def stop(self):
+        """停止を要求する。待機中・一時停止中のスレッドもすぐに戻る"""
+        with self._lock:
+            self.stop_event.set()
+            self._resume_event.set()
+
+    def pause(self):
+        with self._lock:
+            if self._state != RUNNING or self.stop_event.is_set():
+                return False
+            self._resume_event.clear()
+        self._set_state(PAUSED)
+        return True
+
+    def resume(self):
+        with self._lock:
+            if self._state != PAUSED:
+                return False
+            self._resume_event.set()
+        self._set_state(RUNNING)
+        return True
+
+    def wait(self, seconds):
+        """最大seconds秒待つ。停止が要求されたらすぐにFalseを返す"""
+        return not self.stop_event.wait(seconds)
+
+    def checkpoint(self):
+        """一時停止中は再開されるまで待つ。停止が要求されていればFalseを返す"""
+        self._resume_event.wait()
+        return not self.stopped
+
+    def post(self, kind, *args):
+        """UIスレッドへ通知を送る"""
+        self.events.put((kind, args))
+
+    def drain_events(self):
+        """溜まっている通知をすべて取り出す（UIスレッドから呼ぶ）"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
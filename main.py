@@ -1,26 +1,59 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import pyautogui
-from PIL import Image, ImageTk, ImageEnhance, ImageFilter
+from PIL import Image, ImageTk, ImageFilter
 import time
 import threading
 from pynput import keyboard
 import io
 import os
-import platform
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from capture_backends import available_backends, create_backend, default_backend_name
+from capture_session import CaptureSession, enhance_screenshot
+from job_controller import DRAINING, EXPORTING, IDLE, PAUSED, RUNNING, STATE_LABELS, JobController
+from page_edits import EditModel
+from page_render import THUMBNAIL_SIZE, render_preview, render_thumbnail
+from page_store import PageStore
+from session_journal import SessionJournal, discard_session, find_sessions, load_session
+from telemetry import NULL_TELEMETRY, STAGE_LABELS, Telemetry, format_duration
+from page_export import EXPORT_LABELS, EXPORTERS, available_exporters, create_exporter, export_pages, output_size
+from pdf_writer import ExportCancelled, page_layout
+
+# サムネイル列の1枠の大きさ
+THUMB_SLOT_WIDTH = 130
+THUMB_SLOT_HEIGHT = 150
+# 生成済みサムネイルを保持する最大枚数
+THUMB_CACHE_SIZE = 500
+# 生成済みプレビューを保持する最大枚数
+PREVIEW_CACHE_SIZE = 16
+# ワーカーからの通知を確認する間隔（ミリ秒）
+POLL_INTERVAL_MS = 100
+# 範囲選択の拡大鏡の大きさと、拡大する元の範囲（いずれもピクセル）
+MAGNIFIER_SIZE = 200
+MAGNIFIER_SOURCE = 100
+# 余白の自動除去の選択肢（表示名 -> CaptureSessionのtrim）
+TRIM_MODES = {"しない": None, "本全体で共通": "book", "ページごと": "page"}
 
 class ImageEditorWindow(tk.Toplevel):
-    def __init__(self, master, images, app_instance):
+    def __init__(self, master, page_store, app_instance):
         super().__init__(master)
         self.app = app_instance
-        self.original_images = images 
+        self.page_store = page_store
         self.transient(master)
         self.title("画像編集")
         self.geometry("800x700")
         self.protocol("WM_DELETE_WINDOW", self.cancel)
 
         # Data
-        self.image_items = [] # Holds dicts of {"thumb": PhotoImage, "original": PIL.Image, "label": widget}
+        self.edits = EditModel() # 切り抜き・回転などの編集操作（画素は書き換えず、表示と出力のときに適用する）
+        self.thumb_cache = OrderedDict() # (page_id, 操作) -> サムネイル(PIL.Image)。ページIDで保持するので削除しても無効にならない
+        self.visible_thumbs = {} # index -> {"page_id": int, "ops": 操作, "photo": PhotoImage or None, "items": [canvas item ids]}
+        self.pending_thumbs = [] # サムネイル生成待ちのindex
+        self.fill_job = None
+        self.preview_cache = OrderedDict() # (page_id, 操作, 幅, 高さ) -> 高画質プレビュー(PIL.Image)
+        self.render_executor = ThreadPoolExecutor(max_workers=1) # 高画質プレビューと先読みの生成用
         self.current_selection_index = 0
         
         # --- Layout ---
@@ -31,20 +64,34 @@ class ImageEditorWindow(tk.Toplevel):
         ttk.Button(button_frame, text="PDFとして保存", command=self.save_to_pdf).pack(side="right", padx=5)
         ttk.Button(button_frame, text="キャンセル", command=self.cancel).pack(side="right")
 
+        # 編集操作（記録するだけなので全ページに適用してもすぐに終わる）
+        edit_frame = ttk.Frame(self)
+        edit_frame.pack(side="bottom", fill="x", padx=10)
+        ttk.Button(edit_frame, text="左に回転", command=lambda: self.add_edit(("rotate", 90))).pack(side="left", padx=2)
+        ttk.Button(edit_frame, text="右に回転", command=lambda: self.add_edit(("rotate", 270))).pack(side="left", padx=2)
+        ttk.Button(edit_frame, text="余白を除去", command=lambda: self.add_edit(("trim",))).pack(side="left", padx=2)
+        ttk.Button(edit_frame, text="切り抜き...", command=self.ask_crop).pack(side="left", padx=2)
+        ttk.Button(edit_frame, text="レベル補正...", command=self.ask_levels).pack(side="left", padx=2)
+        ttk.Button(edit_frame, text="編集を解除", command=self.clear_edits).pack(side="left", padx=2)
+        self.undo_button = ttk.Button(edit_frame, text="元に戻す", command=self.undo_edit, state=tk.DISABLED)
+        self.undo_button.pack(side="left", padx=2)
+        self.apply_all = tk.BooleanVar(value=False)
+        ttk.Checkbutton(edit_frame, text="全ページに適用", variable=self.apply_all).pack(side="right")
+
         # Section 2: Thumbnails
+        # 表示範囲内のサムネイルだけをキャンバス上に描画する（ページ数に依存しない）
         thumb_container = ttk.Frame(self)
         thumb_container.pack(side="bottom", fill="x", pady=5)
         
-        self.thumb_canvas = tk.Canvas(thumb_container)
-        x_scrollbar = ttk.Scrollbar(thumb_container, orient="horizontal", command=self.thumb_canvas.xview)
-        self.thumb_canvas.configure(xscrollcommand=x_scrollbar.set)
+        self.thumb_canvas = tk.Canvas(thumb_container, height=THUMB_SLOT_HEIGHT, highlightthickness=0)
+        self.x_scrollbar = ttk.Scrollbar(thumb_container, orient="horizontal", command=self.thumb_canvas.xview)
+        self.thumb_canvas.configure(xscrollcommand=self.on_thumb_scroll)
         
-        x_scrollbar.pack(side="bottom", fill="x")
+        self.x_scrollbar.pack(side="bottom", fill="x")
         self.thumb_canvas.pack(side="top", fill="x", expand=True)
-        
-        self.thumb_frame = ttk.Frame(self.thumb_canvas)
-        self.thumb_canvas.create_window((0, 0), window=self.thumb_frame, anchor="nw")
-        self.thumb_frame.bind("<Configure>", lambda e: self.thumb_canvas.configure(scrollregion=self.thumb_canvas.bbox("all")))
+        self.highlight_item = self.thumb_canvas.create_rectangle(0, 0, 0, 0, outline="black", width=2, state="hidden")
+        self.thumb_canvas.bind("<Configure>", lambda e: self.refresh_thumbnails())
+        self.thumb_canvas.bind("<Button-1>", self.on_thumb_click)
 
         # Section 1: Preview
         self.preview_frame = ttk.Frame(self)
@@ -52,96 +99,194 @@ class ImageEditorWindow(tk.Toplevel):
 
         self.preview_label = ttk.Label(self.preview_frame, anchor="center")
         self.preview_label.pack(fill="both", expand=True)
+        # 枠サイズは<Configure>で記録しておき、選択のたびにupdate_idletasksしない
+        self.preview_size = (0, 0)
+        self.preview_frame.bind("<Configure>", self.on_preview_resize)
 
         # --- Bindings ---
         self.bind("<Left>", self.select_previous)
         self.bind("<Right>", self.select_next)
         self.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.bind("<Control-z>", lambda e: self.undo_edit())
 
         # --- Load Images ---
-        self.load_images()
-        if self.image_items:
+        self.update_scroll_region()
+        if len(self.page_store):
             self.select_image(0)
 
-    def load_images(self):
-        for widget in self.thumb_frame.winfo_children():
-            widget.destroy()
-        self.image_items = []
+    def update_scroll_region(self):
+        width = len(self.page_store) * THUMB_SLOT_WIDTH
+        self.thumb_canvas.configure(scrollregion=(0, 0, width, THUMB_SLOT_HEIGHT))
 
-        for i, img in enumerate(self.original_images):
-            thumb_img = img.copy()
-            thumb_img.thumbnail((120, 120))
-            thumb_photo = ImageTk.PhotoImage(thumb_img)
-            
-            label = ttk.Label(self.thumb_frame, image=thumb_photo, text=f" {i+1} ", compound="bottom", cursor="hand2")
-            label.image = thumb_photo # Keep a reference
-            label.pack(side="left", padx=5, pady=5)
-            
-            item_data = {"thumb": thumb_photo, "original": img, "label": label}
-            self.image_items.append(item_data)
-            
-            label.bind("<Button-1>", lambda e, index=i: self.select_image(index))
+    def on_thumb_scroll(self, first, last):
+        self.x_scrollbar.set(first, last)
+        self.refresh_thumbnails()
+
+    def on_thumb_click(self, event):
+        index = int(self.thumb_canvas.canvasx(event.x) // THUMB_SLOT_WIDTH)
+        self.select_image(index)
+
+    def visible_range(self):
+        left = self.thumb_canvas.canvasx(0)
+        right = left + max(self.thumb_canvas.winfo_width(), THUMB_SLOT_WIDTH)
+        first = max(0, int(left // THUMB_SLOT_WIDTH))
+        last = min(len(self.page_store), int(right // THUMB_SLOT_WIDTH) + 1)
+        return range(first, last)
+
+    def refresh_thumbnails(self):
+        """表示範囲に入ったサムネイルを描画し、範囲外になったものを破棄する"""
+        visible = self.visible_range()
+        for index in list(self.visible_thumbs):
+            entry = self.visible_thumbs[index]
+            if (index not in visible or entry["page_id"] != self.page_store.page_id(index)
+                    or entry["ops"] != self.edits.ops_for(entry["page_id"])):
+                for item in self.visible_thumbs.pop(index)["items"]:
+                    self.thumb_canvas.delete(item)
+
+        for index in visible:
+            if index not in self.visible_thumbs:
+                self.draw_thumbnail(index)
+        self.thumb_canvas.tag_raise(self.highlight_item)
+
+    def draw_thumbnail(self, index):
+        page_id = self.page_store.page_id(index)
+        ops = self.edits.ops_for(page_id)
+        x = index * THUMB_SLOT_WIDTH + THUMB_SLOT_WIDTH // 2
+        items = [self.thumb_canvas.create_text(x, THUMB_SLOT_HEIGHT - 10, text=f" {index+1} ")]
+        photo = None
+        thumb = self.thumb_cache.get((page_id, ops))
+        if thumb is not None:
+            self.thumb_cache.move_to_end((page_id, ops))
+            photo = ImageTk.PhotoImage(thumb)
+            items.append(self.thumb_canvas.create_image(x, 5 + THUMBNAIL_SIZE[1] // 2, image=photo))
+        else:
+            # 未生成のサムネイルは枠だけ描画し、アイドル時に1枚ずつ生成する
+            items.append(self.thumb_canvas.create_rectangle(
+                x - 40, 5 + THUMBNAIL_SIZE[1] // 2 - 55, x + 40, 5 + THUMBNAIL_SIZE[1] // 2 + 55, outline="gray"))
+            self.pending_thumbs.append(index)
+            if self.fill_job is None:
+                self.fill_job = self.after_idle(self.fill_thumbnails)
+        self.visible_thumbs[index] = {"page_id": page_id, "ops": ops, "photo": photo, "items": items}
+
+    def fill_thumbnails(self):
+        """生成待ちのサムネイルを1枚生成して描画する（残りは次のアイドル時に回す）"""
+        self.fill_job = None
+        while self.pending_thumbs:
+            index = self.pending_thumbs.pop(0)
+            entry = self.visible_thumbs.get(index)
+            if entry is None or entry["photo"] is not None:
+                continue
+            page_id = entry["page_id"]
+            key = (page_id, entry["ops"])
+            if key not in self.thumb_cache:
+                self.thumb_cache[key] = render_thumbnail(self.page_store.get(page_id), ops=entry["ops"])
+                while len(self.thumb_cache) > THUMB_CACHE_SIZE:
+                    self.thumb_cache.popitem(last=False)
+            for item in self.visible_thumbs.pop(index)["items"]:
+                self.thumb_canvas.delete(item)
+            self.draw_thumbnail(index)
+            self.thumb_canvas.tag_raise(self.highlight_item)
+            break
+        if self.pending_thumbs and self.fill_job is None:
+            self.fill_job = self.after_idle(self.fill_thumbnails)
+
+    def on_preview_resize(self, event):
+        size = (event.width, event.height)
+        if size != self.preview_size:
+            self.preview_size = size
+            if len(self.page_store):
+                self.select_image(self.current_selection_index)
 
     def select_image(self, index):
-        if not (0 <= index < len(self.image_items)):
+        if not (0 <= index < len(self.page_store)):
             return
 
         self.current_selection_index = index
-
-        # Update preview
-        original_img = self.image_items[index]["original"]
-        
-        self.update_idletasks()
-        frame_w = self.preview_frame.winfo_width()
-        frame_h = self.preview_frame.winfo_height()
-        img_w, img_h = original_img.size
-        
+        frame_w, frame_h = self.preview_size
         if frame_w <= 1 or frame_h <= 1:
             self.after(50, lambda: self.select_image(index))
             return
 
-        scale = min(frame_w / img_w, frame_h / img_h)
-        new_w, new_h = int(img_w * scale), int(img_h * scale)
-        
-        # 高品質リサイズアルゴリズムを使用
-        resized_img = original_img.resize((new_w, new_h), Image.LANCZOS)
-        preview_photo = ImageTk.PhotoImage(resized_img)
-        
-        self.preview_label.config(image=preview_photo)
-        self.preview_label.image = preview_photo
+        # Update preview
+        # キャッシュにあれば高画質版を即表示、なければ高速版を表示して高画質版を裏で生成する
+        page_id = self.page_store.page_id(index)
+        ops = self.edits.ops_for(page_id)
+        key = (page_id, ops, frame_w, frame_h)
+        cached = self.preview_cache.get(key)
+        if cached is not None:
+            self.preview_cache.move_to_end(key)
+            self.show_preview(cached)
+        else:
+            self.show_preview(render_preview(self.page_store.get(page_id), self.preview_size, fast=True, ops=ops))
+            self.request_preview(index, key)
+        # 前後のページを先読みしておく
+        for neighbor in (index + 1, index - 1):
+            if 0 <= neighbor < len(self.page_store):
+                neighbor_id = self.page_store.page_id(neighbor)
+                neighbor_key = (neighbor_id, self.edits.ops_for(neighbor_id), frame_w, frame_h)
+                if neighbor_key not in self.preview_cache:
+                    self.request_preview(neighbor, neighbor_key)
 
         # Update thumbnail selection highlight
-        for i, item in enumerate(self.image_items):
-            if i == index:
-                item["label"].config(relief="solid", borderwidth=2)
-            else:
-                item["label"].config(relief="flat")
+        left = index * THUMB_SLOT_WIDTH
+        self.thumb_canvas.coords(self.highlight_item, left + 2, 2, left + THUMB_SLOT_WIDTH - 2, THUMB_SLOT_HEIGHT - 2)
+        self.thumb_canvas.itemconfigure(self.highlight_item, state="normal")
 
         # Auto-scroll logic
-        self.thumb_canvas.update_idletasks()
-        selected_label = self.image_items[index]["label"]
-        
+        total_width = len(self.page_store) * THUMB_SLOT_WIDTH
         canvas_width = self.thumb_canvas.winfo_width()
-        scroll_region = self.thumb_canvas.bbox("all")
-        if not scroll_region: return
-        
-        total_width = scroll_region[2]
         if total_width <= canvas_width: return # No need to scroll
 
-        label_x = selected_label.winfo_x()
-        label_width = selected_label.winfo_width()
+        start_frac = left / total_width
+        end_frac = (left + THUMB_SLOT_WIDTH) / total_width
         
-        start_frac = label_x / total_width
-        end_frac = (label_x + label_width) / total_width
-        
-        view_start = self.thumb_canvas.xview()[0]
-        view_end = self.thumb_canvas.xview()[1]
+        view_start, view_end = self.thumb_canvas.xview()
 
         if start_frac < view_start:
             self.thumb_canvas.xview_moveto(start_frac)
         elif end_frac > view_end:
             self.thumb_canvas.xview_moveto(end_frac - (view_end - view_start))
 
+    def show_preview(self, img):
+        preview_photo = ImageTk.PhotoImage(img)
+        self.preview_label.config(image=preview_photo)
+        self.preview_label.image = preview_photo
+
+    def request_preview(self, index, key):
+        """高画質プレビューの生成をバックグラウンドスレッドに依頼する
+
+        生成したプレビューはTkに触らずに通知キューへ積み、Application.poll_eventsが反映する。
+        """
+        def render():
+            # 連続操作で選択位置から離れたページの生成は省く
+            if abs(index - self.current_selection_index) > 1:
+                return
+            page_id, ops, frame_w, frame_h = key
+            img = render_preview(self.page_store.get(page_id), (frame_w, frame_h), ops=ops)
+            self.app.controller.post("preview", self, key, img)
+
+        try:
+            self.render_executor.submit(render)
+        except RuntimeError:
+            pass # ウィンドウを閉じた後
+
+    def on_preview_rendered(self, key, img):
+        self.preview_cache[key] = img
+        self.preview_cache.move_to_end(key)
+        while len(self.preview_cache) > PREVIEW_CACHE_SIZE:
+            self.preview_cache.popitem(last=False)
+        page_id = key[0]
+        index = self.current_selection_index
+        if (0 <= index < len(self.page_store) and self.page_store.page_id(index) == page_id
+                and key[1] == self.edits.ops_for(page_id) and key[2:] == self.preview_size):
+            self.show_preview(img)
+
+    def destroy(self):
+        self.render_executor.shutdown(wait=False, cancel_futures=True)
+        if self.app.editor is self:
+            self.app.editor = None
+        super().destroy()
+
     def select_next(self, event=None):
         self.select_image(self.current_selection_index + 1)
 
@@ -155,27 +300,118 @@ class ImageEditorWindow(tk.Toplevel):
             self.select_next()
 
     def delete_selected(self):
-        if not self.image_items or not (0 <= self.current_selection_index < len(self.image_items)):
+        if not (0 <= self.current_selection_index < len(self.page_store)):
             return
         
-        self.original_images.pop(self.current_selection_index)
+        # サムネイルはページIDでキャッシュしているので、削除したページ以降は再生成せずに詰め直すだけ
+        page_id = self.page_store.remove(self.current_selection_index)
+        self.thumb_cache.pop((page_id, self.edits.ops_for(page_id)), None)
+        self.edits.forget(page_id)
+        self.undo_button.config(state=tk.NORMAL if self.edits.can_undo else tk.DISABLED)
         
-        if self.current_selection_index >= len(self.original_images):
-            self.current_selection_index = len(self.original_images) - 1
+        if self.current_selection_index >= len(self.page_store):
+            self.current_selection_index = len(self.page_store) - 1
 
-        self.load_images()
+        self.update_scroll_region()
+        self.refresh_thumbnails()
         
-        if not self.image_items:
+        if not len(self.page_store):
+            self.thumb_canvas.itemconfigure(self.highlight_item, state="hidden")
             self.preview_label.config(image=None, text="No images")
         else:
             self.select_image(self.current_selection_index)
 
+    def add_edit(self, op):
+        """選択中のページ（「全ページに適用」なら全ページ）に編集操作を追加する"""
+        if not len(self.page_store):
+            return
+        page_id = None if self.apply_all.get() else self.page_store.page_id(self.current_selection_index)
+        self.edits.add(op, page_id)
+        self.on_edits_changed()
+
+    def clear_edits(self):
+        if not len(self.page_store):
+            return
+        page_id = None if self.apply_all.get() else self.page_store.page_id(self.current_selection_index)
+        self.edits.clear(page_id)
+        self.on_edits_changed()
+
+    def undo_edit(self):
+        if self.edits.undo()[0]:
+            self.on_edits_changed()
+
+    def on_edits_changed(self):
+        # キャッシュは操作を含むキーで引くので、表示中のものを描き直すだけでよい
+        self.undo_button.config(state=tk.NORMAL if self.edits.can_undo else tk.DISABLED)
+        self.refresh_thumbnails()
+        if len(self.page_store):
+            self.select_image(self.current_selection_index)
+
+    def ask_values(self, title, fields):
+        """数値を入力するダイアログを表示し、入力値のリスト（キャンセル時はNone）を返す
+
+        fieldsは (ラベル, 初期値, 最小, 最大, 増分) のリスト。
+        """
+        dialog = tk.Toplevel(self)
+        dialog.title(title)
+        dialog.transient(self)
+        dialog.resizable(False, False)
+        variables = []
+        for row, (label, value, low, high, step) in enumerate(fields):
+            ttk.Label(dialog, text=label).grid(row=row, column=0, sticky="w", padx=10, pady=3)
+            variable = tk.DoubleVar(value=value)
+            ttk.Spinbox(dialog, from_=low, to=high, increment=step, textvariable=variable, width=7).grid(
+                row=row, column=1, padx=10, pady=3)
+            variables.append(variable)
+        result = []
+
+        def confirm():
+            try:
+                result.extend(variable.get() for variable in variables)
+            except tk.TclError:
+                return
+            dialog.destroy()
+
+        buttons = ttk.Frame(dialog)
+        buttons.grid(row=len(fields), column=0, columnspan=2, pady=5)
+        ttk.Button(buttons, text="OK", command=confirm).pack(side="left", padx=5)
+        ttk.Button(buttons, text="キャンセル", command=dialog.destroy).pack(side="left", padx=5)
+        dialog.grab_set()
+        self.wait_window(dialog)
+        return result or None
+
+    def ask_crop(self):
+        values = self.ask_values("切り抜き（表示中の向きで端から削る割合）", [
+            ("上 (%)", 0, 0, 45, 0.5), ("下 (%)", 0, 0, 45, 0.5), ("左 (%)", 0, 0, 45, 0.5), ("右 (%)", 0, 0, 45, 0.5),
+        ])
+        if values:
+            top, bottom, left, right = (min(45.0, max(0.0, v)) / 100 for v in values)
+            self.add_edit(("crop", left, top, 1 - right, 1 - bottom))
+
+    def ask_levels(self):
+        values = self.ask_values("レベル補正", [("黒 (0-254)", 0, 0, 254, 1), ("白 (1-255)", 255, 1, 255, 1),
+                                               ("ガンマ", 1.0, 0.2, 5.0, 0.1)])
+        if values:
+            black, white, gamma = values
+            if white > black and gamma > 0:
+                self.add_edit(("levels", int(black), int(white), gamma))
+
     def save_to_pdf(self):
-        if not self.original_images:
+        if not len(self.page_store):
             messagebox.showwarning("No Images", "There are no images to save.")
             return
-        self.app.save_pdf(self.original_images)
-        self.destroy()
+        if not self.app.save_pdf(self.page_store, self.edits):
+            return
+        # 編集操作はこの画面にしかないので、出力が完了するまでは閉じずに隠しておく
+        # （失敗・キャンセルしたらApplication.finish_exportが編集内容ごと再表示する）
+        self.grab_release()
+        self.withdraw()
+
+    def reopen(self):
+        """出力を中止・失敗したときに、隠していた編集画面を元の編集内容のまま再表示する"""
+        self.deiconify()
+        self.grab_set()
+        self.focus_set()
 
     def cancel(self):
         self.destroy()
@@ -191,26 +427,134 @@ class Application(tk.Frame):
         self.pack(fill=tk.BOTH, expand=True)
         self.screenshot_area = None
         self.click_position = None
-        self.is_running = False
+        self.controller = JobController()
         self.thread = None
-        self.images = []
+        self.page_store = None
+        self.session = None
+        self.end_of_book = False
+        self.export_thread = None
+        self.editor = None
+        self.journal = None
+        self.resume_from = 0
+        self.telemetry = NULL_TELEMETRY
         self.create_widgets()
         self.listener = keyboard.Listener(on_press=self.on_key_press)
         self.listener.start()
         self.master.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.master.after(200, self.offer_resume)
+        self.master.after(POLL_INTERVAL_MS, self.poll_events)
+
+    def offer_resume(self):
+        """前回終了しなかった撮影セッションがあれば再開を提案する"""
+        sessions = find_sessions()
+        if not sessions:
+            return
+        directory = sessions[0]
+        try:
+            settings, pages = load_session(directory)
+        except OSError as e:
+            print(f"セッションの読み込みエラー: {e}")
+            return
+        if not pages:
+            discard_session(directory)
+            return
+        if not messagebox.askyesno(
+                "前回のセッション",
+                f"前回の撮影が完了していません（{len(pages)}枚撮影済み）。\n再開しますか？\n"
+                f"「いいえ」を選ぶと前回の撮影データは削除されます。"):
+            discard_session(directory)
+            return
+
+        # 撮影設定とページを復元する（ページはデコードせずに登録だけ行う）
+        if settings.get("area"):
+            self.screenshot_area = tuple(settings["area"])
+        if settings.get("click"):
+            self.click_position = tuple(settings["click"])
+        self.pdf_path.set(settings.get("pdf_path", self.pdf_path.get()))
+        self.screenshot_count.set(settings.get("count", self.screenshot_count.get()))
+        self.page_store = PageStore(directory=directory)
+        for record in pages:
+            self.page_store.restore(record["page_id"], os.path.join(directory, record["file"]),
+                                    record["size"], record["mode"])
+        self.journal = SessionJournal(directory)
+        self.update_settings_display()
+
+        last_index = pages[-1]["index"]
+        next_index = last_index + 1
+        remaining = self.screenshot_count.get() + 1 - next_index
+        # 中断時のリーダーは保存済みのページより先（処理待ちだった分）まで進んでいることがあるので、
+        # 再開の前に最後に保存されたページを表示し直してもらう（再開時はそのページをめくってから撮影する）
+        if remaining > 0 and messagebox.askyesno(
+                "前回のセッション",
+                f"{next_index}枚目から撮影を続けますか？\n"
+                f"続ける場合は、リーダーに{last_index}枚目に撮影したページ（最後に保存されたページ）を"
+                f"表示してから「はい」を押してください。中断時に表示していたページは保存されていない場合があります。\n"
+                f"「いいえ」を選ぶと編集画面を開きます。"):
+            self.start(resume_from=next_index)
+        else:
+            self.end_of_book = False
+            self.open_editor()
 
     def on_key_press(self, key):
-        if key == keyboard.Key.esc and self.is_running:
-            self.master.after(0, self.emergency_stop)
+        # キーボード監視のスレッドから呼ばれるため、Tkは触らずに停止要求と通知だけを行う
+        if key == keyboard.Key.esc and self.controller.state in (RUNNING, PAUSED, EXPORTING):
+            self.controller.stop()
+            self.controller.post("emergency_stop")
 
     def on_closing(self):
         self.listener.stop()
+        self.controller.stop()
+        if self.journal:
+            self.journal.close()
+        if self.page_store:
+            self.page_store.close()
+        self.telemetry.close()
         self.master.destroy()
 
     def emergency_stop(self):
-        if self.is_running:
-            self.is_running = False
-            messagebox.showinfo("緊急停止", "Escapeキーが押されました。処理を停止します。")
+        messagebox.showinfo("緊急停止", "Escapeキーが押されました。処理を停止します。")
+
+    def poll_events(self):
+        """ワーカーからの通知を一定間隔でまとめて反映する"""
+        page_count = None
+        for kind, args in self.controller.drain_events():
+            if kind == "page":
+                # 撮影枚数は最新の値だけを表示すればよい
+                page_count = args[0]
+            elif kind == "state":
+                self.update_controls(args[0])
+            elif kind == "capture_done":
+                self.update_pipeline_display()
+                self.open_editor()
+            elif kind == "preview":
+                # 生成中に閉じた編集画面のプレビューは捨てる
+                editor, key, img = args
+                if editor is self.editor:
+                    editor.on_preview_rendered(key, img)
+            elif kind == "export_progress":
+                self.show_export_progress(*args)
+            elif kind == "export_done":
+                self.finish_export(*args)
+            elif kind == "error":
+                self.error_label.config(text=args[0])
+            elif kind == "export_error":
+                messagebox.showerror("PDF保存エラー", f"エラー詳細:\n{args[0]}")
+            elif kind == "emergency_stop":
+                self.emergency_stop()
+        if page_count is not None:
+            self.page_count_label.config(text=f"撮影枚数: {page_count}/{self.screenshot_count.get()}")
+        if self.controller.state in (RUNNING, PAUSED, DRAINING):
+            self.update_pipeline_display()
+        self.master.after(POLL_INTERVAL_MS, self.poll_events)
+
+    def update_controls(self, state):
+        """ジョブの状態に合わせてボタンと状態表示を切り替える"""
+        self.start_button.config(state=tk.NORMAL if state == IDLE else tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL if state in (RUNNING, PAUSED, EXPORTING) else tk.DISABLED)
+        self.pause_button.config(state=tk.NORMAL if state in (RUNNING, PAUSED) else tk.DISABLED,
+                                 text="再開" if state == PAUSED else "一時停止")
+        if state != IDLE and not (state == EXPORTING and self.controller.stopped):
+            self.status_label.config(text=STATE_LABELS[state])
 
     def create_widgets(self):
         setting_frame = ttk.LabelFrame(self, text="設定")
@@ -218,19 +562,93 @@ class Application(tk.Frame):
         self.pdf_path = tk.StringVar()
         pdf_path_frame = ttk.Frame(setting_frame)
         pdf_path_frame.pack(fill="x", padx=5, pady=5)
-        ttk.Label(pdf_path_frame, text="PDF出力パス:").pack(side=tk.LEFT)
+        ttk.Label(pdf_path_frame, text="出力パス:").pack(side=tk.LEFT)
         ttk.Entry(pdf_path_frame, textvariable=self.pdf_path).pack(side=tk.LEFT, expand=True, fill="x")
         ttk.Button(pdf_path_frame, text="選択", command=self.select_pdf_path).pack(side=tk.LEFT)
+        # 何回かに分けて撮影する場合は、既存のPDFの末尾にページを追加する
+        append_frame = ttk.Frame(setting_frame)
+        append_frame.pack(fill="x", padx=5)
+        # 出力形式（PDF・CBZ・マルチページTIFF・画像フォルダ）
+        ttk.Label(append_frame, text="形式:").pack(side=tk.LEFT)
+        self.export_format = tk.StringVar(value=EXPORTERS["pdf"].label)
+        format_combo = ttk.Combobox(append_frame, textvariable=self.export_format,
+                                    values=[EXPORTERS[name].label for name in available_exporters()],
+                                    state="readonly", width=16)
+        format_combo.pack(side=tk.LEFT, padx=(5, 10))
+        format_combo.bind("<<ComboboxSelected>>", lambda e: self.on_export_format_changed())
+        self.append_pdf = tk.BooleanVar(value=False)
+        ttk.Checkbutton(append_frame, text="既存のPDFに追記", variable=self.append_pdf,
+                        command=self.update_settings_display).pack(side=tk.LEFT)
+        self.compact_pdf = tk.BooleanVar(value=False)
+        ttk.Checkbutton(append_frame, text="追記後にファイルを最適化", variable=self.compact_pdf,
+                        command=self.update_settings_display).pack(side=tk.LEFT, padx=(10, 0))
         wait_time_frame = ttk.Frame(setting_frame)
         wait_time_frame.pack(fill="x", padx=5, pady=5)
         ttk.Label(wait_time_frame, text="待機時間(秒):").pack(side=tk.LEFT)
         self.wait_time = tk.DoubleVar(value=0.5)
         ttk.Spinbox(wait_time_frame, from_=0.1, to=10.0, increment=0.1, textvariable=self.wait_time, width=5).pack(side=tk.LEFT)
+        # 自動検出モードでは待機時間はタイムアウトとして扱う
+        self.adaptive_wait = tk.BooleanVar(value=False)
+        ttk.Checkbutton(wait_time_frame, text="ページめくりを自動検出", variable=self.adaptive_wait,
+                        command=self.update_settings_display).pack(side=tk.LEFT, padx=(10, 0))
         count_frame = ttk.Frame(setting_frame)
         count_frame.pack(fill="x", padx=5, pady=5)
         ttk.Label(count_frame, text="撮影枚数:").pack(side=tk.LEFT)
         self.screenshot_count = tk.IntVar(value=10)
-        ttk.Spinbox(count_frame, from_=1, to=1000, textvariable=self.screenshot_count, width=5).pack(side=tk.LEFT)
+        ttk.Spinbox(count_frame, from_=1, to=9999, textvariable=self.screenshot_count, width=5).pack(side=tk.LEFT)
+
+        # 重複ページの除外と本の終端での自動停止
+        duplicate_frame = ttk.Frame(setting_frame)
+        duplicate_frame.pack(fill="x", padx=5, pady=5)
+        self.skip_duplicates = tk.BooleanVar(value=True)
+        ttk.Checkbutton(duplicate_frame, text="重複ページを除外", variable=self.skip_duplicates,
+                        command=self.update_settings_display).pack(side=tk.LEFT)
+        ttk.Label(duplicate_frame, text="  同じページが").pack(side=tk.LEFT)
+        self.stop_after_duplicates = tk.IntVar(value=3)
+        ttk.Spinbox(duplicate_frame, from_=0, to=20, textvariable=self.stop_after_duplicates, width=3).pack(side=tk.LEFT)
+        ttk.Label(duplicate_frame, text="回続いたら終了 (0=無効)").pack(side=tk.LEFT)
+
+        # キャプチャ方式
+        backend_frame = ttk.Frame(setting_frame)
+        backend_frame.pack(fill="x", padx=5, pady=5)
+        ttk.Label(backend_frame, text="キャプチャ方式:").pack(side=tk.LEFT)
+        self.capture_backend = tk.StringVar(value=default_backend_name())
+        ttk.Combobox(backend_frame, textvariable=self.capture_backend, values=available_backends(),
+                     state="readonly", width=12).pack(side=tk.LEFT, padx=(5, 0))
+        # 既定ではpyautoguiで撮影したときだけ鮮明化する
+        self.enhance_all = tk.BooleanVar(value=False)
+        ttk.Checkbutton(backend_frame, text="常に鮮明化", variable=self.enhance_all,
+                        command=self.update_settings_display).pack(side=tk.LEFT, padx=(10, 0))
+
+        # モノクロページの省メモリ保持
+        compact_frame = ttk.Frame(setting_frame)
+        compact_frame.pack(fill="x", padx=5, pady=5)
+        self.compact_pages = tk.BooleanVar(value=True)
+        ttk.Checkbutton(compact_frame, text="白黒ページをグレースケールで保持", variable=self.compact_pages,
+                        command=self.update_settings_display).pack(side=tk.LEFT)
+        self.bilevel_pages = tk.BooleanVar(value=False)
+        ttk.Checkbutton(compact_frame, text="2値化", variable=self.bilevel_pages,
+                        command=self.update_settings_display).pack(side=tk.LEFT, padx=(10, 0))
+
+        # 撮影範囲の余白の自動除去（格納前に切り抜くので、以降の処理とPDFが軽くなる）
+        trim_frame = ttk.Frame(setting_frame)
+        trim_frame.pack(fill="x", padx=5, pady=5)
+        ttk.Label(trim_frame, text="余白を自動除去:").pack(side=tk.LEFT)
+        self.trim_mode = tk.StringVar(value="しない")
+        trim_combo = ttk.Combobox(trim_frame, textvariable=self.trim_mode, values=list(TRIM_MODES),
+                                  state="readonly", width=12)
+        trim_combo.pack(side=tk.LEFT, padx=(5, 0))
+        trim_combo.bind("<<ComboboxSelected>>", lambda e: self.update_settings_display())
+
+        # 見開き表示のリーダー向けに、左右のページに分割して格納する
+        spread_frame = ttk.Frame(setting_frame)
+        spread_frame.pack(fill="x", padx=5, pady=5)
+        self.split_spreads = tk.BooleanVar(value=False)
+        ttk.Checkbutton(spread_frame, text="見開きを分割", variable=self.split_spreads,
+                        command=self.update_settings_display).pack(side=tk.LEFT)
+        self.right_to_left = tk.BooleanVar(value=True)
+        ttk.Checkbutton(spread_frame, text="右開き（右ページが先）", variable=self.right_to_left,
+                        command=self.update_settings_display).pack(side=tk.LEFT, padx=(10, 0))
         
         # 画質設定フレーム追加（最適化版）
         quality_frame = ttk.Frame(setting_frame)
@@ -242,6 +660,27 @@ class Application(tk.Frame):
         quality_spinbox.pack(side=tk.LEFT, padx=(5, 10))
         ttk.Label(quality_frame, text="倍 (1.0=軽量, 1.5=推奨, 3.0=高品質)", 
                  font=('Segoe UI', 8)).pack(side=tk.LEFT)
+        # 既定では撮影した画素のまま埋め込み、倍率はページの表示サイズ（DPI）に反映する
+        upscale_frame = ttk.Frame(setting_frame)
+        upscale_frame.pack(fill="x", padx=5)
+        self.upscale_pages = tk.BooleanVar(value=False)
+        ttk.Checkbutton(upscale_frame, text="画素を拡大して埋め込む（従来方式・低速で大容量）",
+                        variable=self.upscale_pages, command=self.update_settings_display).pack(side=tk.LEFT)
+        encoding_frame = ttk.Frame(setting_frame)
+        encoding_frame.pack(fill="x", padx=5)
+        self.auto_encoding = tk.BooleanVar(value=True)
+        ttk.Checkbutton(encoding_frame, text="ページ内容に応じて圧縮方式を選択（文字=2値, 写真=JPEG）",
+                        variable=self.auto_encoding, command=self.update_settings_display).pack(side=tk.LEFT)
+
+        # 処理時間の計測（無効のときは計測のための処理を行わない）
+        telemetry_frame = ttk.Frame(setting_frame)
+        telemetry_frame.pack(fill="x", padx=5, pady=5)
+        self.measure_timing = tk.BooleanVar(value=False)
+        ttk.Checkbutton(telemetry_frame, text="処理時間を計測", variable=self.measure_timing,
+                        command=self.update_settings_display).pack(side=tk.LEFT)
+        self.save_trace = tk.BooleanVar(value=False)
+        ttk.Checkbutton(telemetry_frame, text="トレースを保存（.trace.jsonl）", variable=self.save_trace,
+                        command=self.update_settings_display).pack(side=tk.LEFT, padx=(10, 0))
         
         action_frame = ttk.LabelFrame(self, text="操作")
         action_frame.pack(pady=10, padx=10, fill="x")
@@ -249,21 +688,44 @@ class Application(tk.Frame):
         ttk.Button(action_frame, text="クリック位置設定", command=self.set_click_position).pack(fill="x", pady=5)
         self.start_button = ttk.Button(action_frame, text="開始", command=self.start)
         self.start_button.pack(fill="x", pady=5)
+        self.pause_button = ttk.Button(action_frame, text="一時停止", command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_button.pack(fill="x", pady=5)
         self.stop_button = ttk.Button(action_frame, text="停止", command=self.stop, state=tk.DISABLED)
         self.stop_button.pack(fill="x", pady=5)
         status_frame = ttk.LabelFrame(self, text="状態")
         status_frame.pack(pady=10, padx=10, fill="both", expand=True)
         self.status_label = ttk.Label(status_frame, text="待機中")
         self.status_label.pack(pady=5)
+        # 撮影中の後処理・格納のエラー（状態表示で上書きされないよう別に表示する）
+        self.error_label = ttk.Label(status_frame, text="", foreground="red", wraplength=360)
+        self.error_label.pack()
         self.page_count_label = ttk.Label(status_frame, text="撮影枚数: 0")
         self.page_count_label.pack(pady=5)
+        self.pipeline_label = ttk.Label(status_frame, text="")
+        self.pipeline_label.pack(pady=5)
         self.settings_display = tk.Text(status_frame, height=8, width=45)
         self.settings_display.pack(pady=5, padx=5)
         self.settings_display.config(state=tk.DISABLED)
         self.update_settings_display()
 
+    def export_format_name(self):
+        return next(name for name, cls in EXPORTERS.items() if cls.label == self.export_format.get())
+
+    def on_export_format_changed(self):
+        # 出力パスの拡張子を選んだ形式に合わせる
+        path = self.pdf_path.get()
+        if path:
+            self.pdf_path.set(os.path.splitext(path)[0] + EXPORTERS[self.export_format_name()].extension)
+        self.update_settings_display()
+
     def select_pdf_path(self):
-        path = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF files", "*.pdf")])
+        exporter = EXPORTERS[self.export_format_name()]
+        if not exporter.extension:
+            path = filedialog.askdirectory(title="画像を書き出すフォルダ")
+        else:
+            path = filedialog.asksaveasfilename(
+                defaultextension=exporter.extension, filetypes=[(exporter.label, "*" + exporter.extension)],
+                confirmoverwrite=not (exporter.name == "pdf" and self.append_pdf.get()))
         if path:
             self.pdf_path.set(path)
             self.update_settings_display()
@@ -283,71 +745,101 @@ class Application(tk.Frame):
         self.fullscreen_image = pyautogui.screenshot()
         self.magnifier_window = tk.Toplevel(self.area_selection_window)
         self.magnifier_window.overrideredirect(True)
-        self.magnifier_size = 200
-        self.magnifier_canvas = tk.Canvas(self.magnifier_window, width=self.magnifier_size, height=self.magnifier_size)
+        self.magnifier_canvas = tk.Canvas(self.magnifier_window, width=MAGNIFIER_SIZE, height=MAGNIFIER_SIZE,
+                                          highlightthickness=0)
         self.magnifier_canvas.pack()
-        self.track_mouse()
+        # 画像とカーソル線は1つずつだけ作り、以降は中身と座標を差し替える
+        self.magnifier_photo = ImageTk.PhotoImage("RGB", (MAGNIFIER_SIZE, MAGNIFIER_SIZE))
+        self.magnifier_canvas.create_image(0, 0, anchor=tk.NW, image=self.magnifier_photo)
+        self.magnifier_vline = self.magnifier_canvas.create_line(0, 0, 0, MAGNIFIER_SIZE, fill='red', width=1)
+        self.magnifier_hline = self.magnifier_canvas.create_line(0, 0, MAGNIFIER_SIZE, 0, fill='red', width=1)
+        self.magnifier_position = None
+        self.magnifier_pointer = None
+        self.magnifier_job = None
+        self.area_rect = None
+        # マウスが動いたときだけ描き直す（ドラッグ中は<B1-Motion>側から呼ぶ）
+        self.area_selection_window.bind("<Motion>", self.on_magnifier_motion)
+        x, y = self.area_selection_window.winfo_pointerxy()
+        self.magnifier_pointer = (x, y)
+        self.update_magnifier()
 
-    def track_mouse(self):
-        if not self.area_selection_window.winfo_exists():
-             if hasattr(self, 'magnifier_window') and self.magnifier_window.winfo_exists():
-                self.magnifier_window.destroy()
-             return
+    def on_magnifier_motion(self, event):
+        """マウス位置を記録し、描き直しをアイドル時に1回だけ予約する（連続したイベントはまとめる）"""
+        self.magnifier_pointer = (event.x_root, event.y_root)
+        if self.magnifier_job is None:
+            self.magnifier_job = self.area_selection_window.after_idle(self.update_magnifier)
 
-        x, y = self.area_selection_window.winfo_pointerxy()
-        x = max(0, min(x, self.fullscreen_image.width - 1))
-        y = max(0, min(y, self.fullscreen_image.height - 1))
+    def update_magnifier(self):
+        self.magnifier_job = None
+        if not self.magnifier_window.winfo_exists():
+            return
+        image_width, image_height = self.fullscreen_image.size
+        x, y = self.magnifier_pointer
+        x = max(0, min(x, image_width - 1))
+        y = max(0, min(y, image_height - 1))
 
         # Smart positioning for the magnifier window
         screen_width = self.master.winfo_screenwidth()
         screen_height = self.master.winfo_screenheight()
-        offset = 20 
-        
+        offset = 20
+
         # Adjust Y position
-        if y + self.magnifier_size + offset > screen_height:
-            magnifier_y = y - self.magnifier_size - offset
+        if y + MAGNIFIER_SIZE + offset > screen_height:
+            magnifier_y = y - MAGNIFIER_SIZE - offset
         else:
             magnifier_y = y + offset
 
         # Adjust X position
-        if x + self.magnifier_size + offset > screen_width:
-            magnifier_x = x - self.magnifier_size - offset
+        if x + MAGNIFIER_SIZE + offset > screen_width:
+            magnifier_x = x - MAGNIFIER_SIZE - offset
         else:
             magnifier_x = x + offset
 
-        self.magnifier_window.geometry(f"+{magnifier_x}+{magnifier_y}")
+        if self.magnifier_position != (magnifier_x, magnifier_y):
+            self.magnifier_position = (magnifier_x, magnifier_y)
+            self.magnifier_window.geometry(f"+{magnifier_x}+{magnifier_y}")
 
-        size = 100
-        left = max(0, x - size // 2)
-        top = max(0, y - size // 2)
-        right = min(self.fullscreen_image.width, x + size // 2)
-        bottom = min(self.fullscreen_image.height, y + size // 2)
-
-        if left >= right or top >= bottom:
-            self.area_selection_window.after(50, self.track_mouse)
-            return
+        # 拡大する範囲は常に同じ大きさにし、画面の端ではカーソル線の方を動かす
+        size = min(MAGNIFIER_SOURCE, image_width, image_height)
+        left = max(0, min(x - size // 2, image_width - size))
+        top = max(0, min(y - size // 2, image_height - size))
+        # 切り出しと拡大を1回で行い、PhotoImageの中身をそのまま書き換える
+        zoomed = self.fullscreen_image.resize((MAGNIFIER_SIZE, MAGNIFIER_SIZE), Image.NEAREST,
+                                              box=(left, top, left + size, top + size))
+        self.magnifier_photo.paste(zoomed)
+        zoom = MAGNIFIER_SIZE / size
+        cross_x = (x - left + 0.5) * zoom
+        cross_y = (y - top + 0.5) * zoom
+        self.magnifier_canvas.coords(self.magnifier_vline, cross_x, 0, cross_x, MAGNIFIER_SIZE)
+        self.magnifier_canvas.coords(self.magnifier_hline, 0, cross_y, MAGNIFIER_SIZE, cross_y)
 
-        cropped_image = self.fullscreen_image.crop((left, top, right, bottom))
-        zoomed_image_pil = cropped_image.resize((self.magnifier_size, self.magnifier_size), Image.NEAREST)
-        self.magnifier_photo = ImageTk.PhotoImage(zoomed_image_pil)
-        self.magnifier_canvas.create_image(0, 0, anchor=tk.NW, image=self.magnifier_photo)
-        self.magnifier_canvas.create_line(self.magnifier_size/2, 0, self.magnifier_size/2, self.magnifier_size, fill='red', width=1)
-        self.magnifier_canvas.create_line(0, self.magnifier_size/2, self.magnifier_size, self.magnifier_size/2, fill='red', width=1)
-        self.area_selection_window.after(50, self.track_mouse)
+    def close_magnifier(self):
+        if self.magnifier_job is not None:
+            self.area_selection_window.after_cancel(self.magnifier_job)
+            self.magnifier_job = None
+        if self.magnifier_window.winfo_exists():
+            self.magnifier_window.destroy()
+        # 全画面のスクリーンショットは大きいので、選択が終わったらすぐに手放す
+        self.fullscreen_image = None
+        self.magnifier_photo = None
 
     def on_area_select_start(self, event):
         self.area_start_x = event.x
         self.area_start_y = event.y
+        if self.area_rect:
+            self.area_canvas.delete(self.area_rect)
         self.area_rect = None
 
     def on_area_select_drag(self, event):
         if self.area_rect:
-            self.area_canvas.delete(self.area_rect)
-        self.area_rect = self.area_canvas.create_rectangle(self.area_start_x, self.area_start_y, event.x, event.y, outline='red', width=2)
+            self.area_canvas.coords(self.area_rect, self.area_start_x, self.area_start_y, event.x, event.y)
+        else:
+            self.area_rect = self.area_canvas.create_rectangle(self.area_start_x, self.area_start_y, event.x, event.y,
+                                                               outline='red', width=2)
+        self.on_magnifier_motion(event)
 
     def on_area_select_end(self, event):
-        if hasattr(self, 'magnifier_window') and self.magnifier_window.winfo_exists():
-            self.magnifier_window.destroy()
+        self.close_magnifier()
         self.area_end_x = event.x
         self.area_end_y = event.y
         self.area_selection_window.destroy()
@@ -413,7 +905,7 @@ class Application(tk.Frame):
         self.master.deiconify()
         self.update_settings_display()
 
-    def start(self):
+    def start(self, resume_from=0):
         if not self.pdf_path.get():
             messagebox.showerror("エラー", "PDF出力パスが設定されていません。")
             return
@@ -426,182 +918,253 @@ class Application(tk.Frame):
         if self.screenshot_count.get() <= 0:
             messagebox.showerror("エラー", "撮影枚数は1以上に設定してください。")
             return
+        if self.controller.busy:
+            return
 
-        self.is_running = True
-        self.start_button.config(state=tk.DISABLED)
-        self.stop_button.config(state=tk.NORMAL)
-        self.status_label.config(text="処理中...")
-        self.page_count_label.config(text=f"撮影枚数: 0/{self.screenshot_count.get()}")
-        self.images = []
-        self.thread = threading.Thread(target=self.automation_thread)
+        self.update_controls(RUNNING)
+        self.page_count_label.config(text=f"撮影枚数: {max(0, resume_from - 1)}/{self.screenshot_count.get()}")
+        self.pipeline_label.config(text="")
+        self.error_label.config(text="")
+        self.resume_from = resume_from
+        if not resume_from:
+            # 前回の撮影データを破棄し、新しいセッションに撮影する
+            if self.journal:
+                self.journal.discard()
+            if self.page_store:
+                self.page_store.close()
+            self.journal = SessionJournal.create({
+                "area": list(self.screenshot_area),
+                "click": list(self.click_position),
+                "pdf_path": self.pdf_path.get(),
+                "count": self.screenshot_count.get(),
+            })
+            self.page_store = PageStore(directory=self.journal.directory)
+        self.telemetry.close()
+        self.telemetry = self.create_telemetry()
+        self.session = CaptureSession(
+            self.page_store, self.journal, self.screenshot_area, self.click_position, self.screenshot_count.get(),
+            backend=self.capture_backend.get(), wait_time=self.wait_time.get(), adaptive_wait=self.adaptive_wait.get(),
+            skip_duplicates=self.skip_duplicates.get(), stop_after_duplicates=self.stop_after_duplicates.get(),
+            compact=self.compact_pages.get(), bilevel=self.bilevel_pages.get(),
+            enhance=True if self.enhance_all.get() else None, resume_from=resume_from,
+            controller=self.controller, telemetry=self.telemetry, trim=TRIM_MODES[self.trim_mode.get()],
+            split_spreads=self.split_spreads.get(), right_to_left=self.right_to_left.get(),
+        )
+        self.thread = threading.Thread(target=self.automation_thread, daemon=True)
         self.thread.start()
 
     def stop(self):
-        self.is_running = False
-        self.start_button.config(state=tk.NORMAL)
+        # 待機中・一時停止中でも撮影スレッドはすぐに戻る（UIスレッドは待たない）
+        exporting = self.controller.state == EXPORTING
+        self.controller.stop()
         self.stop_button.config(state=tk.DISABLED)
-        self.status_label.config(text="停止処理中...")
-        
-    def open_editor(self):
-        self.is_running = False
-        self.start_button.config(state=tk.NORMAL)
-        self.stop_button.config(state=tk.DISABLED)
-        self.status_label.config(text="撮影完了。画像編集中...")
-        editor = ImageEditorWindow(self.master, self.images[1:], self)
-        editor.grab_set()
+        self.pause_button.config(state=tk.DISABLED)
+        self.status_label.config(text="PDF保存をキャンセル中..." if exporting else "停止処理中...")
 
-    def save_pdf(self, images_to_save):
-        if self.thread and self.thread.is_alive():
-            self.thread.join()
+    def toggle_pause(self):
+        if not self.controller.pause():
+            self.controller.resume()
 
-        if images_to_save:
-            try:
-                print("従来の方法でPDF保存を実行...")
-                
-                # RGB変換（PDF用）- 3倍拡大して高解像度化
-                converted_images = []
-                for i, img in enumerate(images_to_save):
-                    # まずRGBに変換
-                    if img.mode != 'RGB':
-                        rgb_img = img.convert('RGB')
-                    else:
-                        rgb_img = img
-                    
-                    # 画像を設定倍率で拡大（高品質リサイズ）
-                    scale_factor = self.quality_scale.get()
-                    original_size = rgb_img.size
-                    enlarged_size = (int(original_size[0] * scale_factor), int(original_size[1] * scale_factor))
-                    enlarged_img = rgb_img.resize(enlarged_size, Image.LANCZOS)
-                    
-                    # 読書用最適DPI情報を設定（100-150 DPI）
-                    target_dpi = 100 if scale_factor <= 1.5 else 150
-                    enlarged_img.info['dpi'] = (target_dpi, target_dpi)
-                    converted_images.append(enlarged_img)
-                    print(f"変換後画像 {i+1}: 元サイズ={original_size} -> {scale_factor}倍拡大 -> 拡大後サイズ={enlarged_img.size} (DPI: {target_dpi})")
-                
-                # 読書用最適化PDF保存（軽量で鮮明）
-                converted_images[0].save(
-                    self.pdf_path.get(),
-                    save_all=True,
-                    append_images=converted_images[1:] if len(converted_images) > 1 else [],
-                    resolution=150.0,   # 読書用最適解像度
-                    quality=85,         # 品質と容量のバランス
-                    optimize=True,      # ファイルサイズ最適化
-                    compress_level=6    # 適度な圧縮
-                )
-                
-                self.status_label.config(text=f"読書用最適化PDF保存完了: {self.pdf_path.get()}")
-                
-            except Exception as e:
-                print(f"PDF保存エラー詳細: {e}")
-                messagebox.showerror("PDF保存エラー", f"エラー詳細:\n{str(e)}")
-                self.status_label.config(text="PDF保存エラー")
+    def open_editor(self):
+        if self.session:
+            self.end_of_book = self.session.end_of_book
+        if self.end_of_book:
+            self.status_label.config(text="本の終端を検出しました。画像編集中...")
         else:
+            self.status_label.config(text="撮影完了。画像編集中...")
+        self.editor = ImageEditorWindow(self.master, self.page_store, self)
+        self.editor.grab_set()
+
+    def create_telemetry(self):
+        if not self.measure_timing.get():
+            return NULL_TELEMETRY
+        trace_path = None
+        if self.save_trace.get():
+            trace_path = os.path.splitext(self.pdf_path.get())[0] + ".trace.jsonl"
+        return Telemetry(trace_path)
+
+    def save_pdf(self, pages, edits=None):
+        """ページ変換とPDF書き込みをバックグラウンドで開始する（UIはブロックしない）
+
+        editsの編集操作は、変換するワーカーがページごとにまとめて適用する。
+        出力を開始したらTrue、開始できなかったらFalseを返す。
+        """
+        if not len(pages):
             self.status_label.config(text="保存する画像がありません")
+            return False
 
-    def capture_high_quality_screenshot(self, x, y, width, height):
-        """最高画質でスクリーンショットを取得"""
+        if self.controller.busy:
+            self.status_label.config(text="処理中のため保存できません")
+            return False
+
+        scale_factor, resolution = page_layout(self.quality_scale.get(), self.upscale_pages.get())
+        page_ids = pages.page_ids()
+        page_paths = [pages.entry(page_id).path for page_id in page_ids]
+        page_ops = [edits.ops_for(page_id) for page_id in page_ids] if edits else None
+        if not self.telemetry.enabled:
+            # 撮影せずに編集画面を開いた場合（セッションの再開など）は出力だけを計測する
+            self.telemetry = self.create_telemetry()
+        self.controller.begin(EXPORTING)
+        self.update_controls(EXPORTING)
+        self.status_label.config(text=f"PDF変換中... 0/{len(page_paths)}")
+        self.export_thread = threading.Thread(
+            target=self.export_thread_main,
+            args=(page_paths, self.pdf_path.get(), self.export_format_name(), scale_factor, resolution,
+                  self.auto_encoding.get(), page_ops, self.append_pdf.get(), self.compact_pdf.get()),
+            daemon=True
+        )
+        self.export_thread.start()
+        return True
+
+    def export_thread_main(self, page_paths, pdf_path, export_format, scale_factor, resolution, auto_encoding,
+                           page_ops, append, compact):
+        # 撮影は完了している（編集画面は撮影スレッドの終了後に開く）ので、ここでは待たない
+        def progress(done, total):
+            self.controller.post("export_progress", done, total)
+
+        label = EXPORTERS[export_format].label
         try:
-            if platform.system() == "Windows":
-                # Windows の場合、DPI対応の高解像度スクリーンショットを試行
-                try:
-                    import win32gui
-                    import win32ui
-                    import win32con
-                    from PIL import Image
-                    
-                    # デスクトップのデバイスコンテキストを取得
-                    hdesktop = win32gui.GetDesktopWindow()
-                    desktop_dc = win32gui.GetWindowDC(hdesktop)
-                    img_dc = win32ui.CreateDCFromHandle(desktop_dc)
-                    mem_dc = img_dc.CreateCompatibleDC()
-                    
-                    # ビットマップを作成
-                    screenshot = win32ui.CreateBitmap()
-                    screenshot.CreateCompatibleBitmap(img_dc, width, height)
-                    mem_dc.SelectObject(screenshot)
-                    
-                    # 高品質でコピー（HALFTONE モードで品質向上）
-                    mem_dc.SetStretchBltMode(win32con.HALFTONE)
-                    mem_dc.BitBlt((0, 0), (width, height), img_dc, (x, y), win32con.SRCCOPY)
-                    
-                    # ビットマップデータを取得
-                    bmpinfo = screenshot.GetInfo()
-                    bmpstr = screenshot.GetBitmapBits(True)
-                    
-                    # PILイメージに変換
-                    img = Image.frombuffer(
-                        'RGB',
-                        (bmpinfo['bmWidth'], bmpinfo['bmHeight']),
-                        bmpstr, 'raw', 'BGRX', 0, 1
-                    )
-                    
-                    # リソースを解放
-                    mem_dc.DeleteDC()
-                    img_dc.DeleteDC()
-                    win32gui.ReleaseDC(hdesktop, desktop_dc)
-                    win32gui.DeleteObject(screenshot.GetHandle())
-                    
-                    print(f"Windows API高解像度スクリーンショット取得: {img.size}")
-                    return img
-                    
-                except ImportError:
-                    print("pywin32が利用できません。pyautoguiを使用します。")
-                    pass
-                except Exception as e:
-                    print(f"Windows API スクリーンショット取得エラー: {e}")
-                    pass
-        except:
-            pass
-        
-        # フォールバック: pyautoguiを使用（最高品質設定）
-        print("pyautoguiでスクリーンショット取得")
-        screenshot = pyautogui.screenshot(region=(x, y, width, height))
-        
-        # スクリーンショット後の品質向上処理
-        # 1. シャープネス強化（文字をより鮮明に）
-        
-        # 読書用画質調整（自然で読みやすい品質）
-        contrast_enhancer = ImageEnhance.Contrast(screenshot)
-        screenshot = contrast_enhancer.enhance(1.05)  # 軽微なコントラスト向上
-        
-        # シャープネス調整（自然な文字の鮮明さ）
-        sharpness_enhancer = ImageEnhance.Sharpness(screenshot)
-        screenshot = sharpness_enhancer.enhance(1.1)  # 控えめなシャープネス向上
-        
-        print(f"スクリーンショット品質向上処理完了: {screenshot.size}")
+            print(f"並列変換で{label}保存を実行... ({os.cpu_count()}プロセス, {scale_factor}倍拡大, {resolution:.0f} DPI)")
+            start = time.perf_counter()
+            options = {"scale_factor": scale_factor, "quality": 85, "resolution": resolution,
+                       "auto_encoding": auto_encoding}
+            append = export_format == "pdf" and append and os.path.exists(pdf_path)
+            if export_format == "pdf":
+                options.update(append=append, compact=compact)
+            if append:
+                print(f"既存のPDFに追記します: {pdf_path}")
+            # ページはプロセスプールで変換し、ページ順に1枚ずつ書き込む
+            kinds = export_pages(page_paths, create_exporter(export_format, pdf_path, **options),
+                                 progress=progress, cancel_event=self.controller.stop_event,
+                                 telemetry=self.telemetry, page_ops=page_ops)
+            print(f"{label}保存完了: {len(page_paths)}ページ {time.perf_counter() - start:.1f}秒")
+            for i, kind in enumerate(kinds):
+                print(f"ページ {i+1}: {EXPORT_LABELS[kind]}")
+            summary = ", ".join(f"{EXPORT_LABELS[kind]} {kinds.count(kind)}枚"
+                                for kind in EXPORT_LABELS if kind in kinds)
+            size_mb = output_size(pdf_path) / 1024 / 1024
+            action = f"{len(page_paths)}ページを追記" if append else "保存完了"
+            self.controller.post("export_done", f"読書用最適化{label}{action}: {pdf_path}\n{size_mb:.1f} MB ({summary})",
+                                 True)
+        except ExportCancelled:
+            self.controller.post("export_done", f"{label}保存をキャンセルしました")
+        except Exception as e:
+            print(f"{label}保存エラー詳細: {e}")
+            self.controller.post("export_error", str(e))
+            self.controller.post("export_done", f"{label}保存エラー")
+        finally:
+            self.controller.finish()
+
+    def show_export_progress(self, done, total):
+        if self.controller.stopped:
+            return
+        text = f"PDF変換中... {done}/{total}"
+        eta = self.telemetry.eta("export_page", total - done)
+        if eta is not None:
+            text += f"（残り約{format_duration(eta)}）"
+        self.status_label.config(text=text)
+
+    def finish_export(self, message, completed=False):
+        if self.telemetry.enabled:
+            for stage, values in self.telemetry.summary().items():
+                print(f"{STAGE_LABELS.get(stage, stage)}: 平均{values['average'] * 1000:.1f}ms × {values['count']}回")
+            self.telemetry.close()
+            self.telemetry = NULL_TELEMETRY
+        if self.editor is not None:
+            if completed:
+                self.editor.destroy()
+            else:
+                self.editor.reopen()
+        if completed and self.journal:
+            # 出力まで完了したセッションは再開の対象から外す
+            self.journal.discard()
+            self.journal = None
+            self.page_store.close()
+            self.page_store = None
+        self.status_label.config(text=message)
+
+    def capture_high_quality_screenshot(self, x, y, width, height):
+        """最高画質でスクリーンショットを取得（範囲選択のプレビュー用）"""
+        with create_backend(self.capture_backend.get()) as backend:
+            screenshot = backend.grab(x, y, width, height)
+            print(f"{backend.name}でスクリーンショット取得: {screenshot.size}")
+            if backend.needs_enhance or self.enhance_all.get():
+                screenshot = enhance_screenshot(screenshot)
         return screenshot
 
     def automation_thread(self):
-        max_pages = self.screenshot_count.get() + 1
-        for page_count in range(1, max_pages + 1):
-            if not self.is_running:
-                break
-
-            x1, y1, x2, y2 = self.screenshot_area
-            # 最高解像度でスクリーンショットを取得
-            screenshot = self.capture_high_quality_screenshot(x1, y1, x2 - x1, y2 - y1)
-            # PNG形式で高品質を保持（ロスレス圧縮）
-            self.images.append(screenshot)
-            
-            display_page_count = max(0, page_count - 1)
-            self.master.after(0, self.page_count_label.config, {"text": f"撮影枚数: {display_page_count}/{self.screenshot_count.get()}"})
-
-            if page_count < max_pages:
-                wait = 1.0 if page_count == 1 else self.wait_time.get()
-                time.sleep(wait)
-                if self.is_running:
-                    pyautogui.click(self.click_position)
-        
-        self.master.after(0, self.open_editor)
+        # 撮影ループはTkに依存しないCaptureSessionで実行し、進捗は通知キュー経由でUIに渡す
+        try:
+            self.session.run()
+        finally:
+            self.controller.post("capture_done")
+
+    def update_pipeline_display(self):
+        pipeline = self.session.pipeline if self.session else None
+        if pipeline is None:
+            return
+        stats = pipeline.stats
+        text = (f"キュー: {pipeline.queue_depth}/{pipeline.max_queue}  "
+                f"撮影 {stats.pages_per_minute('capture'):.1f} / "
+                f"処理 {stats.pages_per_minute('process'):.1f} / "
+                f"保存 {stats.pages_per_minute('store'):.1f} 枚/分")
+        duplicates = self.session.duplicate_detector.duplicates
+        if duplicates:
+            text += f"\n重複除外: {duplicates}枚"
+        if self.telemetry.enabled:
+            text += "\n" + self.format_telemetry()
+        self.pipeline_label.config(text=text)
+
+    def format_telemetry(self):
+        """各ステージの平均時間と残り時間の見積もり"""
+        telemetry = self.telemetry
+        parts = [
+            f"{STAGE_LABELS[stage]} {telemetry.average_seconds(stage) * 1000:.0f}ms"
+            for stage in ("wait", "click_to_capture", "capture", "enhance", "encode", "store")
+            if telemetry.counts.get(stage)
+        ]
+        text = " / ".join(parts)
+        captured = telemetry.counts.get("capture", 0) + self.session.resume_from
+        eta = telemetry.eta("page", self.screenshot_count.get() + 1 - captured)
+        if eta is not None and self.session.is_running:
+            text += f"\n残り約{format_duration(eta)}（1ページ {telemetry.average_seconds('page'):.2f}秒）"
+        return text
 
     def update_settings_display(self):
         self.settings_display.config(state=tk.NORMAL)
         self.settings_display.delete(1.0, tk.END)
         self.settings_display.insert(tk.END, f"PDFパス: {self.pdf_path.get()}\n")
-        self.settings_display.insert(tk.END, f"待機時間: {self.wait_time.get()}秒\n")
+        if self.export_format_name() != "pdf":
+            self.settings_display.insert(tk.END, f"出力形式: {self.export_format.get()}\n")
+        elif self.append_pdf.get():
+            compact = "、追記後に最適化" if self.compact_pdf.get() else ""
+            self.settings_display.insert(tk.END, f"出力: 既存のPDFに追記{compact}\n")
+        if self.enhance_all.get():
+            self.settings_display.insert(tk.END, f"キャプチャ方式: {self.capture_backend.get()}（常に鮮明化）\n")
+        else:
+            self.settings_display.insert(tk.END, f"キャプチャ方式: {self.capture_backend.get()}\n")
+        if self.adaptive_wait.get():
+            self.settings_display.insert(tk.END, f"待機時間: 自動検出（最大{self.wait_time.get()}秒）\n")
+        else:
+            self.settings_display.insert(tk.END, f"待機時間: {self.wait_time.get()}秒\n")
         self.settings_display.insert(tk.END, f"撮影枚数: {self.screenshot_count.get()}枚\n")
-        self.settings_display.insert(tk.END, f"画質設定: {self.quality_scale.get()}倍拡大\n")
+        if self.skip_duplicates.get():
+            self.settings_display.insert(tk.END, "重複ページ: 除外\n")
+        if self.compact_pages.get():
+            mode = "2値" if self.bilevel_pages.get() else "グレースケール"
+            self.settings_display.insert(tk.END, f"白黒ページ: {mode}で保持\n")
+        if self.split_spreads.get():
+            order = "右→左" if self.right_to_left.get() else "左→右"
+            self.settings_display.insert(tk.END, f"見開き: 分割（{order}）\n")
+        if TRIM_MODES[self.trim_mode.get()]:
+            self.settings_display.insert(tk.END, f"余白除去: {self.trim_mode.get()}\n")
+        if self.measure_timing.get():
+            trace = "（トレースを保存）" if self.save_trace.get() else ""
+            self.settings_display.insert(tk.END, f"処理時間: 計測する{trace}\n")
+        if self.upscale_pages.get():
+            self.settings_display.insert(tk.END, f"画質設定: {self.quality_scale.get()}倍拡大\n")
+        else:
+            self.settings_display.insert(tk.END, f"画質設定: 原寸埋め込み（{self.quality_scale.get()}倍サイズで表示）\n")
         
         if self.screenshot_area:
             self.settings_display.insert(tk.END, f"スクリーンショット範囲: {self.screenshot_area}\n")
@@ -0,0 +1,356 @@
+"""撮影したページの内容解析（知覚ハッシュなど）"""
+import threading
+
+from PIL import Image, ImageChops
+
+
+def dhash(img, hash_size=16):
+    """差分ハッシュ(dHash)を計算する
+
+    縮小したグレースケール画像で横方向に隣り合う画素の大小を比較し、
+    hash_size * hash_size ビットの整数として返す。
+    """
+    small = img.resize((hash_size + 1, hash_size), Image.BILINEAR, reducing_gap=2.0).convert("L")
+    pixels = small.tobytes()
+    width = hash_size + 1
+    value = 0
+    for row in range(hash_size):
+        offset = row * width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class DuplicateDetector:
+    """直前のページの繰り返し（めくれなかったページ）と本の終端（変化しないページの連続）を検出する
+
+    max_distance以下のハミング距離を同じページとみなす。除外するのは直前と同じページだけで、
+    離れた位置にある同じページ（白紙や区切りのページ）は残す。ほぼ一様なページ
+    （dHashの立っているビットがblank_bits以下）は白紙が続くことがあるので連続していても残す。
+    stop_after回連続で直前のページと同じだった場合にend_reachedがTrueになる（0で無効）。
+    """
+
+    def __init__(self, max_distance=3, stop_after=3, blank_bits=8):
+        self.max_distance = max_distance
+        self.stop_after = stop_after
+        self.blank_bits = blank_bits
+        self.previous = None
+        self.consecutive = 0
+        self.duplicates = 0
+
+    def observe(self, page_hash):
+        """直前のページと同じページが続いた回数を更新する（重複を除外しない場合も呼ぶ）"""
+        if self.previous is not None and hamming_distance(self.previous, page_hash) <= self.max_distance:
+            self.consecutive += 1
+        else:
+            self.consecutive = 0
+        self.previous = page_hash
+
+    def is_blank(self, page_hash):
+        return bin(page_hash).count("1") <= self.blank_bits
+
+    def check(self, page_hash):
+        """ページが直前のページの繰り返しで、除外すべきならTrueを返す"""
+        self.observe(page_hash)
+        duplicate = self.consecutive > 0 and not self.is_blank(page_hash)
+        if duplicate:
+            self.duplicates += 1
+        return duplicate
+
+    @property
+    def end_reached(self):
+        return self.stop_after > 0 and self.consecutive >= self.stop_after
+
+
+def compact_page(img, tolerance=24, color_ratio=0.005, bilevel=False, threshold=128):
+    """モノクロのページをモードL（bilevel=Trueなら2値のモード1）に変換して返す
+
+    RGB各チャンネルの差がtoleranceを超える画素がcolor_ratio未満なら
+    モノクロとみなす（ClearTypeの色にじみ程度は許容する）。カラーページはそのまま返す。
+    """
+    if img.mode == "RGB":
+        r, g, b = img.split()
+        spread = ImageChops.lighter(ImageChops.difference(r, g), ImageChops.difference(g, b))
+        colored = sum(spread.histogram()[tolerance + 1:])
+        if colored >= color_ratio * img.width * img.height:
+            return img
+        img = img.convert("L")
+    if img.mode == "L" and bilevel:
+        img = img.point(lambda v: 255 if v >= threshold else 0, "1")
+    return img
+
+
+# classify_page()が返すページ種別
+PAGE_BILEVEL = "bilevel"      # 白黒の文字ページ
+PAGE_GRAY = "gray"            # 階調の少ないグレー（線画・漫画）
+PAGE_PALETTE = "palette"      # 256色以下のカラー（図版・イラスト）
+PAGE_GRAY_PHOTO = "gray_photo"
+PAGE_PHOTO = "photo"
+
+
+def classify_page(img, saturation_level=40, colorful_ratio=0.01, midtone_bilevel=0.05, midtone_gray=0.25):
+    """ヒストグラムと彩度からページの種類を判定する
+
+    - 彩度の高い画素がcolorful_ratio未満ならグレースケールとして扱い、
+      中間調(64-191)の割合で 2値 / 階調の少ないグレー / グレー写真 に分ける
+    - カラーページは256色以下ならパレット、それ以外は写真とする
+    """
+    if img.mode == "1":
+        return PAGE_BILEVEL
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+
+    if img.mode == "RGB":
+        # 彩度の判定は縮小画像で十分
+        small = img.reduce(2) if min(img.size) >= 256 else img
+        saturation = small.convert("HSV").getchannel("S").histogram()
+        if sum(saturation[saturation_level:]) > colorful_ratio * small.width * small.height:
+            if img.getcolors(256) is not None:
+                return PAGE_PALETTE
+            return PAGE_PHOTO
+        img = img.convert("L")
+
+    histogram = img.histogram()
+    total = img.width * img.height
+    midtones = sum(histogram[64:192]) / total
+    if midtones < midtone_bilevel:
+        return PAGE_BILEVEL
+    if midtones < midtone_gray:
+        return PAGE_GRAY
+    return PAGE_GRAY_PHOTO
+
+
+def reduced_gray(img, target=200):
+    """内容解析用に、短辺がtarget程度になるよう縮小したグレースケール画像と縮小率を返す"""
+    factor = max(1, min(img.width, img.height) // target)
+    return (img.reduce(factor) if factor > 1 else img).convert("L"), factor
+
+
+def background_level(probe):
+    """最も多い明るさを背景色とみなす"""
+    histogram = probe.histogram()
+    return histogram.index(max(histogram))
+
+
+def ink_mask(probe, tolerance=24, background=None):
+    """背景色との差がtoleranceを超える画素を255、それ以外を0にした2値のマスク"""
+    if background is None:
+        background = background_level(probe)
+    mask = ImageChops.difference(probe, Image.new("L", probe.size, background))
+    return mask.point(lambda v: 255 if v > tolerance else 0)
+
+
+def content_bounds(probe, tolerance=24, min_ink=0.005):
+    """縮小グレースケール画像で、背景色と異なる内容を含む範囲 (左, 上, 右, 下) を求める
+
+    背景色（最も多い明るさ）との差を2値化し、1行・1列に平均縮小して行・列ごとの
+    内容の割合（射影）を得る。割合がmin_ink未満の行・列は背景とみなすので、
+    カーソルやゴミなどの小さな点では範囲が広がらない。内容がなければNone。
+    """
+    mask = ink_mask(probe, tolerance)
+    threshold = int(min_ink * 255)
+    columns = mask.resize((probe.width, 1), Image.BOX).tobytes()
+    rows = mask.resize((1, probe.height), Image.BOX).tobytes()
+    xs = [x for x, v in enumerate(columns) if v > threshold]
+    ys = [y for y, v in enumerate(rows) if v > threshold]
+    if not xs or not ys:
+        return None
+    return xs[0], ys[0], xs[-1] + 1, ys[-1] + 1
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+class AutoTrimmer:
+    """撮影範囲の余白を除去する切り抜き範囲を決める（どのスレッドから呼んでもよい）
+
+    mode="page"ならページごとの内容範囲で切り抜く。
+    mode="book"なら最初のwarmup枚の内容範囲を辺ごとに中央値と中央絶対偏差(MAD)で比べ、
+    外れ値（白紙・全面の挿絵・短い最終行など）を除いた残りを囲む範囲を本全体で共通に使う。
+    共通の範囲からはみ出す内容のあるページは、そのページだけ範囲を広げる（内容は切らない）。
+    """
+
+    def __init__(self, mode="book", warmup=5, padding=0.01, tolerance=24, outlier_mad=3.0):
+        if mode not in ("book", "page"):
+            raise ValueError(f"不明な余白除去モードです: {mode}")
+        self.mode = mode
+        self.warmup = warmup
+        self.padding = padding
+        self.tolerance = tolerance
+        self.outlier_mad = outlier_mad
+        self.samples = []
+        self.box = None
+        self.size = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        if mode == "page":
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def observe(self, img):
+        """ページの内容範囲を元の画像の座標で返す（内容がなければNone）"""
+        probe, factor = reduced_gray(img)
+        bounds = content_bounds(probe, self.tolerance)
+        if bounds is None:
+            return None
+        left, top, right, bottom = (v * factor for v in bounds)
+        # 縮小で切り捨てられた端の画素も含める
+        if bounds[2] == probe.width:
+            right = img.width
+        if bounds[3] == probe.height:
+            bottom = img.height
+        return left, top, right, bottom
+
+    def add_sample(self, img_size, page_box):
+        """本全体の範囲を決めるための内容範囲を追加する（warmup枚で確定）"""
+        with self._lock:
+            if self._ready.is_set():
+                return
+            self.size = img_size
+            self.samples.append(page_box)
+            if len(self.samples) >= self.warmup:
+                self._finalize_locked()
+
+    def finalize(self):
+        """warmup枚に満たなくても、それまでの内容範囲で本全体の範囲を確定する"""
+        with self._lock:
+            if not self._ready.is_set():
+                self._finalize_locked()
+
+    def _finalize_locked(self):
+        boxes = [box for box in self.samples if box is not None]
+        if boxes:
+            width, height = self.size
+            slack = (0.02 * width, 0.02 * height, 0.02 * width, 0.02 * height)
+            edges = []
+            for edge in range(4):
+                values = [box[edge] for box in boxes]
+                median = _median(values)
+                mad = _median([abs(v - median) for v in values])
+                limit = self.outlier_mad * mad + slack[edge]
+                edges.append([v for v in values if abs(v - median) <= limit])
+            self.box = (min(edges[0]), min(edges[1]), max(edges[2]), max(edges[3]))
+            print(f"余白除去: 本全体の範囲を {tuple(int(v) for v in self.box)} に決定"
+                  f"（{len(boxes)}ページから）")
+        self._ready.set()
+
+    def wait(self):
+        """本全体の範囲が確定するまで待つ"""
+        self._ready.wait()
+
+    def crop_box(self, img_size, page_box):
+        """切り抜く範囲（余白を加えた整数座標）を返す。切り抜く必要がなければNone"""
+        box = page_box if self.mode == "page" else self.box
+        if box is None:
+            return None
+        if self.mode == "book" and page_box is not None and (
+                page_box[0] < box[0] or page_box[1] < box[1] or page_box[2] > box[2] or page_box[3] > box[3]):
+            box = (min(box[0], page_box[0]), min(box[1], page_box[1]),
+                   max(box[2], page_box[2]), max(box[3], page_box[3]))
+        width, height = img_size
+        pad_x = self.padding * width
+        pad_y = self.padding * height
+        box = (max(0, int(box[0] - pad_x)), max(0, int(box[1] - pad_y)),
+               min(width, int(box[2] + pad_x + 0.5)), min(height, int(box[3] + pad_y + 0.5)))
+        if box == (0, 0, width, height) or box[2] <= box[0] or box[3] <= box[1]:
+            return None
+        return box
+
+
+def find_gutter(probe, tolerance=24, band=(0.3, 0.7), max_ink=0.01):
+    """見開きの縮小グレースケール画像から、左右のページの境目（のど）の列を求める
+
+    列ごとの内容の割合（1行に平均縮小した射影）を中央付近で調べ、内容のない列が
+    最も長く続く範囲の中央を返す（同じ長さなら画像の中央に近い方）。見つからなければNone。
+    """
+    columns = ink_mask(probe, tolerance).resize((probe.width, 1), Image.BOX).tobytes()
+    threshold = int(max_ink * 255)
+    low, high = int(probe.width * band[0]), int(probe.width * band[1])
+    center = probe.width / 2
+    best = None
+    start = None
+    for x in range(low, high + 1):
+        blank = x < high and columns[x] <= threshold
+        if blank and start is None:
+            start = x
+        elif not blank and start is not None:
+            middle = (start + x) / 2
+            key = (x - start, -abs(middle - center))
+            if best is None or key > best[0]:
+                best = (key, middle)
+            start = None
+    return None if best is None else best[1]
+
+
+class SpreadSplitter:
+    """見開きの撮影画像を左右のページに分割する（どのスレッドから呼んでもよい）
+
+    のどの位置は一度求めたら使い回し、画像の大きさが変わったときか、記録した位置の
+    周りの細い帯に内容が入ったとき（レイアウトが変わったとき）だけ求め直す。
+    のどが見つからなかった場合も同じ大きさの間は結果を使い回し、画像の中央の細い帯が
+    空白になったとき（見開き表示に切り替わったとき）だけ求め直す。
+    横長でない画像（単ページの表紙など）は分割しない。
+    right_to_left=Trueなら右ページを先にする（右開きの日本語の本）。
+    """
+
+    def __init__(self, right_to_left=False, tolerance=24):
+        self.right_to_left = right_to_left
+        self.tolerance = tolerance
+        self._lock = threading.Lock()
+        self._size = None
+        self._gutter = None
+        self._background = None
+        self.detections = 0
+
+    def _strip_is_blank(self, img, x, background):
+        """x座標の周りの細い帯に、内容のない列があればTrue"""
+        half = max(2, img.width // 200)
+        strip = img.crop((x - half, 0, x + half, img.height)).convert("L")
+        columns = ink_mask(strip, self.tolerance, background).resize((strip.width, 1), Image.BOX).tobytes()
+        return min(columns) <= int(0.01 * 255)
+
+    def gutter(self, img):
+        """のどのx座標（分割しない画像ならNone）"""
+        if img.width <= img.height:
+            return None
+        with self._lock:
+            cached = self._size == img.size
+            gutter, background = self._gutter, self._background
+        if cached:
+            if gutter is not None and self._strip_is_blank(img, gutter, background):
+                return gutter
+            if gutter is None and not self._strip_is_blank(img, img.width // 2, background):
+                return None
+        probe, factor = reduced_gray(img)
+        found = find_gutter(probe, self.tolerance)
+        gutter = None if found is None else int(found * factor)
+        with self._lock:
+            self.detections += 1
+            self._size = img.size
+            self._gutter = gutter
+            self._background = background_level(probe)
+        return gutter
+
+    def split(self, img):
+        """読む順にページ画像を返すイテレータ（分割しなければ元の画像だけ）
+
+        のどの位置はすぐに求めるが、ページの切り出しは1枚ずつ行うので、
+        呼び出し側が前のページを処理し終えてから次のページが作られる。
+        """
+        gutter = self.gutter(img)
+        if gutter is None:
+            return iter([img])
+        boxes = [(0, 0, gutter, img.height), (gutter, 0, img.width, img.height)]
+        if self.right_to_left:
+            boxes.reverse()
+        return (img.crop(box) for box in boxes)
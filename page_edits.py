@@ -0,0 +1,182 @@
+"""編集画面の非破壊編集（切り抜き・回転・余白除去・レベル補正）
+
+編集は画素を書き換えずに操作のリストとして記録する。操作はタプルで表す。
+  ("crop", 左, 上, 右, 下)      表示中の向きでの割合（0〜1）で指定する切り抜き
+  ("rotate", 角度)               反時計回りに90/180/270度
+  ("trim",)                      背景色の余白を自動で除去
+  ("levels", 黒, 白, ガンマ)     レベル補正
+割合で記録するので、縮小画像にも原寸画像にも同じ操作を適用できる。
+適用時は操作をまとめて「切り抜き1回・回転1回・LUT1回」にしてから処理する。
+"""
+from PIL import Image
+
+from page_analysis import content_bounds, reduced_gray
+
+# 余白除去で背景とみなす差の大きさと、残す余白（内容の大きさに対する割合）
+TRIM_TOLERANCE = 24
+TRIM_PADDING = 0.01
+
+_TRANSPOSE = {90: Image.Transpose.ROTATE_90, 180: Image.Transpose.ROTATE_180, 270: Image.Transpose.ROTATE_270}
+
+
+def _view_to_source(rotation, left, top, right, bottom):
+    """表示中の向きでの割合の範囲を、回転前の画像での割合の範囲に変換する"""
+    if rotation == 90:
+        return 1 - bottom, left, 1 - top, right
+    if rotation == 180:
+        return 1 - right, 1 - bottom, 1 - left, 1 - top
+    if rotation == 270:
+        return top, 1 - right, bottom, 1 - left
+    return left, top, right, bottom
+
+
+def trim_probe(img):
+    """余白検出用の縮小グレースケール画像と縮小率を返す"""
+    return reduced_gray(img)
+
+
+def content_box(probe, factor=1, tolerance=TRIM_TOLERANCE, padding=TRIM_PADDING):
+    """背景色と異なる部分を囲む範囲を、縮小画像の行・列の射影から求める
+
+    範囲は縮小前の座標（probe * factor）で返す。内容が見つからなければNone。
+    """
+    bbox = content_bounds(probe, tolerance)
+    if bbox is None:
+        return None
+    pad_x = (bbox[2] - bbox[0]) * padding
+    pad_y = (bbox[3] - bbox[1]) * padding
+    return (max(0.0, (bbox[0] - pad_x) * factor), max(0.0, (bbox[1] - pad_y) * factor),
+            min(probe.width, bbox[2] + pad_x) * factor, min(probe.height, bbox[3] + pad_y) * factor)
+
+
+def levels_lut(black, white, gamma):
+    """レベル補正の256段階のLUT"""
+    span = max(1, white - black)
+    lut = []
+    for value in range(256):
+        x = min(1.0, max(0.0, (value - black) / span))
+        lut.append(int(255 * x ** (1.0 / gamma) + 0.5))
+    return lut
+
+
+def plan_edits(img, ops):
+    """操作リストを (回転前の画像での切り抜き範囲, 回転角度, LUT) にまとめる
+
+    余白除去は、それまでの切り抜き範囲を縮小画像上で調べて求める。
+    """
+    box = (0.0, 0.0, float(img.width), float(img.height))
+    rotation = 0
+    lut = None
+    probe = None
+    for op in ops:
+        kind = op[0]
+        if kind == "crop":
+            l, t, r, b = _view_to_source(rotation, *op[1:5])
+            w, h = box[2] - box[0], box[3] - box[1]
+            box = (box[0] + w * l, box[1] + h * t, box[0] + w * r, box[1] + h * b)
+        elif kind == "rotate":
+            rotation = (rotation + op[1]) % 360
+        elif kind == "trim":
+            if probe is None:
+                probe, factor = trim_probe(img)
+            region = probe.crop(tuple(int(round(v / factor)) for v in box))
+            found = content_box(region, factor)
+            if found is not None:
+                box = (box[0] + found[0], box[1] + found[1], box[0] + found[2], box[1] + found[3])
+        elif kind == "levels":
+            step = levels_lut(*op[1:4])
+            lut = step if lut is None else [step[v] for v in lut]
+    return box, rotation, lut
+
+
+def apply_edits(img, ops, max_size=None):
+    """操作リストを適用した画像を返す（opsが空なら元の画像をそのまま返す）
+
+    max_sizeを指定すると、切り抜いた直後に縮小してから回転・補正する（サムネイル・プレビュー用）。
+    """
+    if not ops:
+        return img
+    box, rotation, lut = plan_edits(img, ops)
+    box = tuple(int(round(v)) for v in box)
+    if box[2] - box[0] < 1 or box[3] - box[1] < 1:
+        box = (0, 0, img.width, img.height)
+    if box != (0, 0, img.width, img.height):
+        img = img.crop(box)
+    elif max_size is not None:
+        # 元の画像（ストアのキャッシュ）は書き換えない
+        img = img.copy()
+    if max_size is not None:
+        if rotation in (90, 270):
+            max_size = (max_size[1], max_size[0])
+        img.thumbnail(max_size, Image.BICUBIC, reducing_gap=2.0)
+    if rotation:
+        img = img.transpose(_TRANSPOSE[rotation])
+    if lut is not None:
+        if img.mode in ("1", "P"):
+            img = img.convert("L" if img.mode == "1" else "RGB")
+        img = img.point(lut * len(img.getbands()))
+    return img
+
+
+class EditModel:
+    """ページごと・全ページ共通の操作リストと、元に戻すための履歴を保持する
+
+    履歴には操作リストだけを記録するので、画素のコピーは持たない。
+    操作には通し番号を付け、全ページ共通の操作とページごとの操作を記録順に合成する。
+    """
+
+    def __init__(self):
+        self.global_ops = []
+        self.page_ops = {}
+        self._history = []
+        self._next_seq = 0
+
+    def __bool__(self):
+        return bool(self.global_ops or self.page_ops)
+
+    def add(self, op, page_id=None):
+        """操作を追加する（page_idを省略すると全ページに適用）"""
+        seq = self._next_seq
+        self._next_seq += 1
+        if page_id is None:
+            self._history.append((None, list(self.global_ops)))
+            self.global_ops.append((seq, op))
+        else:
+            self._history.append((page_id, list(self.page_ops.get(page_id, []))))
+            self.page_ops.setdefault(page_id, []).append((seq, op))
+
+    def clear(self, page_id=None):
+        """ページ（省略時は全ページ共通）の操作をすべて取り消す"""
+        if page_id is None:
+            self._history.append((None, list(self.global_ops)))
+            self.global_ops = []
+        else:
+            self._history.append((page_id, list(self.page_ops.get(page_id, []))))
+            self.page_ops.pop(page_id, None)
+
+    def undo(self):
+        """直前の追加・取り消しを元に戻し、(戻したか, 対象のpage_id（全ページならNone）) を返す"""
+        if not self._history:
+            return False, None
+        page_id, previous = self._history.pop()
+        if page_id is None:
+            self.global_ops = previous
+        elif previous:
+            self.page_ops[page_id] = previous
+        else:
+            self.page_ops.pop(page_id, None)
+        return True, page_id
+
+    @property
+    def can_undo(self):
+        return bool(self._history)
+
+    def ops_for(self, page_id):
+        """ページに適用する操作を記録順に並べたタプル（キャッシュのキーにも使う）"""
+        ops = self.global_ops + self.page_ops.get(page_id, [])
+        return tuple(op for _, op in sorted(ops))
+
+    def forget(self, page_id):
+        """削除したページの操作を破棄する"""
+        self.page_ops.pop(page_id, None)
+        self._history = [entry for entry in self._history if entry[0] != page_id]
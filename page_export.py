@@ -0,0 +1,390 @@
+"""ページの書き出し形式（PDF・CBZ・マルチページTIFF・画像フォルダ）
+
+書き出し形式はregister_exporter()で登録したものをcreate_exporter()で名前から生成する。
+export_pages()はページの変換（編集操作の適用・拡大・エンコード）をプロセスプールで
+並列に行い、書き出し先へはページ順に1枚ずつ書き込む。どの形式でも処理中のページ数は
+ワーカー数の2倍までで、メモリ使用量は一定に保たれる。
+"""
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from PIL import Image, TiffImagePlugin, features
+
+from pdf_writer import (ENCODING_LABELS, READING_DPI, AppendingPdfWriter, ExportCancelled, StreamingPdfWriter,
+                        compact_pdf, convert_page_file, new_file_mode, open_page_file, replace_file)
+from telemetry import NULL_TELEMETRY
+
+EXPORTERS = {}
+
+# 画像フォルダに書き出すページのファイル名（0001.png, 0002.webp, ...）
+PAGE_FILE_PATTERN = re.compile(r"\d{4,}\.(png|webp)")
+
+# PDF以外の形式で選んだ格納方式の表示名
+EXPORT_LABELS = dict(ENCODING_LABELS, **{
+    "copy": "PNG (そのまま格納)",
+    "png": "PNG",
+    "webp": "WebP (可逆)",
+    "tiff_group4": "2値 (CCITT G4)",
+    "tiff_deflate": "Deflate",
+    "tiff_packbits": "PackBits",
+})
+
+
+def register_exporter(name):
+    """書き出し形式のクラスを名前で登録するデコレータ"""
+    def decorator(cls):
+        cls.name = name
+        EXPORTERS[name] = cls
+        return cls
+    return decorator
+
+
+def available_exporters():
+    """この環境で使える書き出し形式の名前の一覧"""
+    return [name for name, cls in EXPORTERS.items() if cls.is_available()]
+
+
+def create_exporter(name, path, **options):
+    if name not in EXPORTERS:
+        raise ValueError(f"不明な出力形式です: {name}")
+    return EXPORTERS[name](path, **options)
+
+
+def _scaled(img, scale_factor):
+    if scale_factor == 1.0:
+        return img
+    return img.resize((int(img.width * scale_factor), int(img.height * scale_factor)), Image.LANCZOS)
+
+
+def convert_page_image(path, image_format, scale_factor=1.0, resolution=READING_DPI, ops=()):
+    """ページファイルを可逆の画像ファイル（PNG/WebP）のバイト列に変換する（ワーカープロセスで実行）"""
+    img = _scaled(open_page_file(path, ops), scale_factor)
+    buffer = io.BytesIO()
+    if image_format == "webp":
+        img.save(buffer, "WEBP", lossless=True, method=4)
+    else:
+        img.save(buffer, "PNG", dpi=(resolution, resolution))
+    return image_format, buffer.getvalue()
+
+
+def convert_page_tiff(path, scale_factor=1.0, resolution=READING_DPI, ops=()):
+    """ページファイルを1ページのTIFFのバイト列に変換する（ワーカープロセスで実行）
+
+    2値のページはCCITT G4、それ以外はDeflateで圧縮する（libtiffがなければPackBits）。
+    """
+    img = _scaled(open_page_file(path, ops), scale_factor)
+    if not features.check("libtiff"):
+        compression = "packbits"
+    elif img.mode == "1":
+        compression = "group4"
+    else:
+        compression = "tiff_deflate"
+    buffer = io.BytesIO()
+    img.save(buffer, "TIFF", compression=compression, dpi=(resolution, resolution))
+    kind = compression if compression.startswith("tiff_") else f"tiff_{compression}"
+    return kind, buffer.getvalue()
+
+
+def _done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class PageExporter:
+    """書き出し形式の基底クラス
+
+    submit()でワーカーにページの変換を依頼し、その結果をwrite_page()にページ順に渡す。
+    close()で書き出しを完了し、abort()で書きかけのファイルを削除する。
+    """
+    name = None
+    label = None
+    extension = None
+
+    def __init__(self, path, scale_factor=1.0, quality=85, resolution=READING_DPI, auto_encoding=False):
+        self.path = path
+        self.scale_factor = scale_factor
+        self.quality = quality
+        self.resolution = resolution
+        self.auto_encoding = auto_encoding
+        self.page_count = 0
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def submit(self, pool, path, ops):
+        """ページの変換をプールに依頼し、Futureを返す"""
+        raise NotImplementedError
+
+    def write_page(self, page):
+        """変換済みのページを書き込み、選んだ格納方式を返す"""
+        raise NotImplementedError
+
+    def close(self):
+        """書き出しを完了する"""
+
+    def abort(self):
+        """書き出しを中止し、書きかけのものを削除する"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                self.close()
+            except BaseException:
+                # 書き込みやfsyncの失敗（容量不足など）でも書きかけのファイルを残さない
+                self.abort()
+                raise
+        else:
+            self.abort()
+        return False
+
+
+@register_exporter("pdf")
+class PdfExporter(PageExporter):
+    """PDF（append=Trueで既存のファイルがあれば増分更新で追記）"""
+    label = "PDF"
+    extension = ".pdf"
+
+    def __init__(self, path, append=False, compact=False, **options):
+        super().__init__(path, **options)
+        self.append = append and os.path.exists(path)
+        self.compact = compact
+        writer_class = AppendingPdfWriter if self.append else StreamingPdfWriter
+        self.writer = writer_class(path, resolution=self.resolution, quality=self.quality)
+
+    def submit(self, pool, path, ops):
+        return pool.submit(convert_page_file, path, self.scale_factor, self.quality, self.auto_encoding, ops)
+
+    def write_page(self, page):
+        self.writer.add_encoded_page(page)
+        self.page_count += 1
+        return page.kind
+
+    def close(self):
+        self.writer.close()
+        if self.append and self.compact:
+            compact_pdf(self.path)
+
+    def abort(self):
+        self.writer.abort()
+
+
+class _ImageFilesExporter(PageExporter):
+    """ページを1枚ずつの画像ファイルとして書き出す形式の共通部分
+
+    編集操作も拡大もないページは、ページストアのPNGをデコードせずにそのまま使う。
+    """
+
+    def __init__(self, path, image_format="png", **options):
+        super().__init__(path, **options)
+        if image_format not in ("png", "webp"):
+            raise ValueError(f"不明な画像形式です: {image_format}")
+        self.image_format = image_format
+
+    def submit(self, pool, path, ops):
+        if not ops and self.scale_factor == 1.0 and self.image_format == "png" and path.lower().endswith(".png"):
+            return _done(("copy", path))
+        return pool.submit(convert_page_image, path, self.image_format, self.scale_factor, self.resolution, ops)
+
+    def write_page(self, page):
+        kind, data = page
+        self.page_count += 1
+        extension = ".webp" if kind == "webp" else ".png"
+        self.write_file(f"{self.page_count:04d}{extension}", kind, data)
+        return kind
+
+    def write_file(self, name, kind, data):
+        """kindが"copy"ならdataはコピー元のパス、それ以外は画像ファイルのバイト列"""
+        raise NotImplementedError
+
+
+@register_exporter("cbz")
+class CbzExporter(_ImageFilesExporter):
+    """CBZ（無圧縮で格納したZIP。画像は既に圧縮済みなので再圧縮しない）"""
+    label = "CBZ"
+    extension = ".cbz"
+
+    def __init__(self, path, **options):
+        super().__init__(path, **options)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, self.temp_path = tempfile.mkstemp(prefix=".", suffix=".cbz.part", dir=directory)
+        self._file = os.fdopen(fd, "wb")
+        self._zip = zipfile.ZipFile(self._file, "w", zipfile.ZIP_STORED)
+
+    def write_file(self, name, kind, data):
+        if kind == "copy":
+            self._zip.write(data, name)
+        else:
+            self._zip.writestr(name, data)
+
+    def close(self):
+        self._zip.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        replace_file(self.temp_path, self.path)
+
+    def abort(self):
+        self._zip.close()
+        self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+@register_exporter("images")
+class ImageFolderExporter(_ImageFilesExporter):
+    """連番の画像ファイル（0001.png, 0002.png, ...）を書き出すフォルダ
+
+    書き出しは隣に作る一時フォルダに対して行い、close()で出力先へ移す。既存のフォルダへ
+    書き出す場合は、前回書き出した連番のファイルを消してから入れ替える（他のファイルは残す）。
+    abort()は一時フォルダを消すだけなので、書き出す前からあったファイルは消えない。
+    """
+    label = "画像フォルダ"
+    extension = ""
+
+    def __init__(self, path, **options):
+        super().__init__(path, **options)
+        if os.path.exists(path) and not os.path.isdir(path):
+            raise FileExistsError(f"出力先がフォルダではありません: {path}")
+        parent, name = os.path.split(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self.temp_path = tempfile.mkdtemp(prefix=f".{name}.", suffix=".part", dir=parent)
+
+    def write_file(self, name, kind, data):
+        target = os.path.join(self.temp_path, name)
+        if kind == "copy":
+            shutil.copyfile(data, target)
+        else:
+            with open(target, "wb") as f:
+                f.write(data)
+
+    def close(self):
+        if not os.path.isdir(self.path):
+            os.chmod(self.temp_path, new_file_mode(directory=True))
+            os.replace(self.temp_path, self.path)
+            return
+        for entry in os.scandir(self.path):
+            if PAGE_FILE_PATTERN.fullmatch(entry.name) and entry.is_file():
+                os.remove(entry.path)
+        for name in sorted(os.listdir(self.temp_path)):
+            os.replace(os.path.join(self.temp_path, name), os.path.join(self.path, name))
+        os.rmdir(self.temp_path)
+
+    def abort(self):
+        shutil.rmtree(self.temp_path, ignore_errors=True)
+
+
+@register_exporter("tiff")
+class TiffExporter(PageExporter):
+    """マルチページTIFF（ページごとのTIFFをワーカーで圧縮し、順に連結する）"""
+    label = "マルチページTIFF"
+    extension = ".tif"
+
+    def __init__(self, path, **options):
+        super().__init__(path, **options)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, self.temp_path = tempfile.mkstemp(prefix=".", suffix=".tif.part", dir=directory)
+        os.close(fd)
+        self._writer = TiffImagePlugin.AppendingTiffWriter(self.temp_path, new=True)
+
+    def submit(self, pool, path, ops):
+        return pool.submit(convert_page_tiff, path, self.scale_factor, self.resolution, ops)
+
+    def write_page(self, page):
+        kind, data = page
+        # AppendingTiffWriterは書き込まれた1ページ分のTIFFのオフセットを連結用に書き換える
+        self._writer.write(data)
+        self._writer.newFrame()
+        self.page_count += 1
+        return kind
+
+    def close(self):
+        self._writer.close()
+        replace_file(self.temp_path, self.path)
+
+    def abort(self):
+        if not self._writer.f.closed:
+            self._writer.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def export_pages(page_paths, exporter, workers=None, progress=None, cancel_event=None, telemetry=None,
+                 page_ops=None):
+    """ページファイルをプロセスプールで並列に変換し、ページ順にexporterへ書き込む
+
+    progress(完了数, 総数)を1ページごとに呼ぶ。cancel_eventがセットされると
+    ExportCancelledを送出し、書きかけのものは削除する（PDFの追記なら元に戻す）。
+    各ページで選んだ格納方式のリストを返す。
+    telemetryを渡すと、変換待ち・書き込み・1ページあたりの時間を記録する。
+    page_opsはページごとの編集操作のリスト（page_pathsと同じ順）。
+    """
+    workers = workers or os.cpu_count() or 1
+    total = len(page_paths)
+    telemetry = telemetry or NULL_TELEMETRY
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        with exporter:
+            pending = deque()
+            kinds = []
+            paths = zip(page_paths, page_ops or [()] * total)
+            for path, ops in paths:
+                pending.append(exporter.submit(pool, path, ops))
+                if len(pending) >= workers * 2:
+                    break
+            last_page = time.perf_counter()
+            while pending:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ExportCancelled()
+                start = time.perf_counter()
+                page = pending.popleft().result()
+                written = time.perf_counter()
+                kinds.append(exporter.write_page(page))
+                end = time.perf_counter()
+                telemetry.record("export_wait", written - start, exporter.page_count)
+                telemetry.record("export_write", end - written, exporter.page_count)
+                telemetry.record("export_page", end - last_page, exporter.page_count)
+                last_page = end
+                for path, ops in paths:
+                    pending.append(exporter.submit(pool, path, ops))
+                    break
+                if progress is not None:
+                    progress(exporter.page_count, total)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return kinds
+
+
+def export_pdf(page_paths, pdf_path, scale_factor=1.0, quality=85, resolution=READING_DPI,
+               workers=None, progress=None, cancel_event=None, auto_encoding=False, telemetry=None,
+               page_ops=None, append=False, compact=False):
+    """ページファイルをプロセスプールで並列に変換し、ページ順にPDFへ書き込む
+
+    export_pages()にPDF形式を指定するのと同じ（引数はそちらを参照）。
+    append=Trueで出力パスのPDFが既にあれば、既存のページを読み直さずに増分更新で
+    末尾へページを追加する。compact=Trueなら追加後にファイルを1つの相互参照表に書き直す。
+    各ページで選んだ圧縮方式のリストを返す。
+    """
+    exporter = create_exporter("pdf", pdf_path, scale_factor=scale_factor, quality=quality, resolution=resolution,
+                               auto_encoding=auto_encoding, append=append, compact=compact)
+    return export_pages(page_paths, exporter, workers=workers, progress=progress, cancel_event=cancel_event,
+                        telemetry=telemetry, page_ops=page_ops)
+
+
+def output_size(path):
+    """書き出したファイル（画像フォルダなら中の連番のファイルの合計）のバイト数"""
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path)
+                   if PAGE_FILE_PATTERN.fullmatch(entry.name) and entry.is_file())
+    return os.path.getsize(path)
@@ -0,0 +1,44 @@
+"""編集画面のサムネイル・プレビュー用の縮小画像を生成する（Tkに依存しない）"""
+from PIL import Image
+
+from page_edits import apply_edits
+
+THUMBNAIL_SIZE = (120, 120)
+
+
+def render_thumbnail(img, size=THUMBNAIL_SIZE, ops=()):
+    """ページからサムネイル用の縮小画像を生成する（opsは編集操作のリスト）"""
+    if ops:
+        # 切り抜いた範囲を先に縮小し、回転・補正は縮小後の画像に行う
+        img = apply_edits(img, ops, max_size=size)
+    # 2値ページは縮小の画質のためLに変換する（RGBには戻さない）
+    thumb = img.convert("L") if img.mode == "1" else img.copy()
+    thumb.thumbnail(size, Image.BICUBIC, reducing_gap=2.0)
+    return thumb
+
+
+def fit_size(image_size, frame_size):
+    """枠に収まるように縦横比を保った表示サイズを返す"""
+    img_w, img_h = image_size
+    frame_w, frame_h = frame_size
+    scale = min(frame_w / img_w, frame_h / img_h)
+    return max(1, int(img_w * scale)), max(1, int(img_h * scale))
+
+
+def render_preview(img, frame_size, fast=False, ops=()):
+    """プレビュー用に枠へ収まるよう縮小する（opsは編集操作のリスト）
+
+    fast=Trueのときは整数倍の縮小(reduce)とNEARESTで素早く生成し、
+    それ以外はLANCZOSで高画質に生成する。
+    """
+    if ops:
+        img = apply_edits(img, ops, max_size=frame_size if fast else None)
+    size = fit_size(img.size, frame_size)
+    if img.mode == "1":
+        img = img.convert("L")
+    if fast:
+        factor = max(1, min(img.width // size[0], img.height // size[1]))
+        if factor > 1:
+            img = img.reduce(factor)
+        return img.resize(size, Image.NEAREST)
+    return img.resize(size, Image.LANCZOS)
@@ -0,0 +1,122 @@
+"""撮影したページをディスクへ退避し、必要なときだけ読み込むページストア"""
+import io
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+
+from PIL import Image
+
+# ディスク上のページ1枚分の情報
+PageEntry = namedtuple("PageEntry", "path size mode")
+
+
+class PageStore:
+    """ページをPNG(高速圧縮)でスピルディレクトリに保存し、デコード済みページは小さなLRUで保持する
+
+    ページ数に関わらずメモリ上に残るのはLRUに入っている数ページ分だけになる。
+    撮影スレッドとUIスレッドの両方から使われるため、操作はロックで保護する。
+    """
+
+    def __init__(self, directory=None, cache_size=8, compress_level=1):
+        self._owns_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix="auto_screenshot_")
+        self.cache_size = cache_size
+        self.compress_level = compress_level
+        self._order = []
+        self._entries = {}
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._next_id = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._order)
+
+    def __getitem__(self, index):
+        return self.get(self.page_id(index))
+
+    def __iter__(self):
+        # 反復中の削除に備えてIDのスナップショットを取り、1ページずつ読み込む
+        for page_id in self.page_ids():
+            yield self.get(page_id)
+
+    def encode(self, img):
+        """ページをPNGにエンコードする（スレッドから並列に呼んでよい）"""
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG", compress_level=self.compress_level)
+        return buffer.getvalue()
+
+    def append(self, img):
+        """ページをディスクへ書き出し、ページIDを返す"""
+        return self.append_encoded(self.encode(img), img.size, img.mode)
+
+    def append_encoded(self, data, size, mode):
+        """encode()済みのページを書き出し、ページIDを返す"""
+        with self._lock:
+            page_id = self._next_id
+            self._next_id += 1
+        path = os.path.join(self.directory, f"{page_id:06d}.png")
+        with open(path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            self._entries[page_id] = PageEntry(path, size, mode)
+            self._order.append(page_id)
+        return page_id
+
+    def restore(self, page_id, path, size, mode):
+        """既にディスクにあるページを（デコードせずに）末尾へ登録する"""
+        with self._lock:
+            self._entries[page_id] = PageEntry(path, tuple(size), mode)
+            self._order.append(page_id)
+            self._next_id = max(self._next_id, page_id + 1)
+
+    def page_id(self, index):
+        with self._lock:
+            return self._order[index]
+
+    def page_ids(self):
+        with self._lock:
+            return list(self._order)
+
+    def entry(self, page_id):
+        with self._lock:
+            return self._entries[page_id]
+
+    def get(self, page_id):
+        """ページをデコードして返す（LRUキャッシュ経由）"""
+        with self._lock:
+            img = self._cache.get(page_id)
+            if img is not None:
+                self._cache.move_to_end(page_id)
+                return img
+            path = self._entries[page_id].path
+
+        img = Image.open(path)
+        img.load()
+
+        with self._lock:
+            self._cache[page_id] = img
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return img
+
+    def remove(self, index):
+        """指定位置のページを削除し、そのページIDを返す"""
+        with self._lock:
+            page_id = self._order.pop(index)
+            entry = self._entries.pop(page_id)
+            self._cache.pop(page_id, None)
+        if os.path.exists(entry.path):
+            os.remove(entry.path)
+        return page_id
+
+    def close(self):
+        """キャッシュを解放し、一時ディレクトリを削除する"""
+        with self._lock:
+            self._cache.clear()
+            self._order = []
+            self._entries = {}
+        if self._owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,54 @@
+"""クリック後の画面変化を監視してページめくりの完了を検出する"""
+import time
+
+from PIL import ImageChops, ImageStat
+
+
+def frame_difference(a, b):
+    """2枚のフレームの平均絶対差（0-255）を返す"""
+    if a.size != b.size:
+        return 255.0
+    diff = ImageChops.difference(a, b)
+    return sum(ImageStat.Stat(diff).mean) / len(diff.getbands())
+
+
+class PageTurnDetector:
+    """縮小した監視用フレームを連続取得し、変化した後に安定した時点でページめくり完了とみなす
+
+    grab_probeは縮小済みの監視用フレームを返す関数。
+    """
+
+    def __init__(self, grab_probe, change_threshold=2.0, stable_frames=3, poll_interval=0.03):
+        self.grab_probe = grab_probe
+        self.change_threshold = change_threshold
+        self.stable_frames = stable_frames
+        self.poll_interval = poll_interval
+
+    def wait_for_settle(self, reference, timeout, should_continue=None):
+        """クリック前のフレームから変化し、stable_frames回連続で変化しなくなるまで待つ
+
+        (安定を検出したか, 経過秒数) を返す。timeoutを過ぎた場合やshould_continue()が
+        Falseを返した場合は検出できなかったものとして戻る。
+        """
+        start = time.perf_counter()
+        changed = False
+        previous = reference
+        stable = 0
+        while time.perf_counter() - start < timeout:
+            if should_continue is not None and not should_continue():
+                break
+            time.sleep(self.poll_interval)
+            frame = self.grab_probe()
+            difference = frame_difference(previous, frame)
+            previous = frame
+            if not changed:
+                # まず画面がクリック前から変化するのを待つ
+                changed = difference > self.change_threshold
+                continue
+            if difference <= self.change_threshold:
+                stable += 1
+                if stable >= self.stable_frames:
+                    return True, time.perf_counter() - start
+            else:
+                stable = 0
+        return False, time.perf_counter() - start
@@ -0,0 +1,566 @@
+"""1ページずつエンコードしてファイルへ書き出すストリーミングPDFライター"""
+import bisect
+import io
+import os
+import re
+import stat
+import tempfile
+import zlib
+from collections import namedtuple
+
+from PIL import Image
+
+from page_analysis import (PAGE_BILEVEL, PAGE_GRAY, PAGE_GRAY_PHOTO, PAGE_PALETTE, PAGE_PHOTO,
+                           classify_page)
+from page_edits import apply_edits
+
+# 読書用最適解像度（拡大方式で埋め込むときのDPI）
+READING_DPI = 150.0
+
+# PDFに埋め込むためにエンコード済みのページ画像（kindは選択した圧縮方式）
+EncodedPage = namedtuple("EncodedPage", "width height color_space bits filter data kind")
+
+# 圧縮方式ごとの表示名
+ENCODING_LABELS = {
+    PAGE_BILEVEL: "2値 (Flate)",
+    PAGE_GRAY: "グレー (Flate)",
+    PAGE_PALETTE: "パレット (Flate)",
+    PAGE_GRAY_PHOTO: "グレー (JPEG)",
+    PAGE_PHOTO: "カラー (JPEG)",
+}
+
+
+def _encode_jpeg(img, quality):
+    if img.mode == "1":
+        img = img.convert("L")
+    elif img.mode != "L" and img.mode != "RGB":
+        img = img.convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=quality)
+    if img.mode == "L":
+        return EncodedPage(img.width, img.height, "/DeviceGray", 8, "/DCTDecode", buffer.getvalue(), PAGE_GRAY_PHOTO)
+    return EncodedPage(img.width, img.height, "/DeviceRGB", 8, "/DCTDecode", buffer.getvalue(), PAGE_PHOTO)
+
+
+def _encode_palette(img, quality):
+    colors = img.convert("RGB").getcolors(256)
+    if colors is None:
+        # 判定後の拡大（LANCZOS）で中間色が増え、256色に収まらなくなったページは写真として埋め込む
+        return _encode_jpeg(img, quality)
+    # 実際に使われている色だけのパレットへ誤差なしで割り当てる
+    palette = [channel for _, color in colors for channel in color]
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette(palette)
+    indexed = img.convert("RGB").quantize(palette=palette_image, dither=Image.Dither.NONE)
+    lookup = bytes(palette).hex().upper()
+    color_space = f"[/Indexed /DeviceRGB {len(colors) - 1} <{lookup}>]"
+    return EncodedPage(indexed.width, indexed.height, color_space, 8, "/FlateDecode",
+                       zlib.compress(indexed.tobytes()), PAGE_PALETTE)
+
+
+def encode_page(img, quality=85, kind=None):
+    """PIL画像をPDF埋め込み用のストリームにエンコードする
+
+    kindにclassify_page()の判定結果を渡すと、2値・グレー・パレットのページは
+    可逆のFlate圧縮で、写真はJPEGで埋め込む。省略時は常にJPEGを使う。
+    """
+    if kind == PAGE_BILEVEL:
+        bilevel = img if img.mode == "1" else img.convert("L").point(lambda v: 255 if v >= 128 else 0, "1")
+        # モード"1"の画素は1=白で、PDFのDeviceGray(1bit)と同じ並び
+        return EncodedPage(bilevel.width, bilevel.height, "/DeviceGray", 1, "/FlateDecode",
+                           zlib.compress(bilevel.tobytes()), PAGE_BILEVEL)
+    if kind == PAGE_GRAY:
+        gray = img if img.mode == "L" else img.convert("L")
+        return EncodedPage(gray.width, gray.height, "/DeviceGray", 8, "/FlateDecode",
+                           zlib.compress(gray.tobytes()), PAGE_GRAY)
+    if kind == PAGE_PALETTE:
+        return _encode_palette(img, quality)
+    if kind == PAGE_GRAY_PHOTO and img.mode != "L":
+        img = img.convert("L")
+    return _encode_jpeg(img, quality)
+
+
+def open_page_file(path, ops=()):
+    """ページファイルを読み込み、編集操作を適用した画像を返す（モードはRGB・L・1のいずれか）"""
+    with Image.open(path) as img:
+        if img.mode not in ("RGB", "L", "1"):
+            img = img.convert("RGB")
+        else:
+            img.load()
+        # 編集画面で記録した操作（切り抜き・回転・補正）はここでまとめて1回だけ適用する
+        return apply_edits(img, ops)
+
+
+def convert_page_file(path, scale_factor, quality=85, auto_encoding=False, ops=()):
+    """ページファイルを読み込み、編集操作の適用・拡大・エンコードを行う（ワーカープロセスで実行）
+
+    プロセス間ではファイルパスと操作リスト、エンコード済みのバイト列だけを受け渡し、
+    PIL画像そのものはpickleしない。
+    """
+    img = open_page_file(path, ops)
+    # 内容の判定は拡大前の画像で行う
+    kind = classify_page(img) if auto_encoding else None
+    if scale_factor != 1.0:
+        enlarged_size = (int(img.width * scale_factor), int(img.height * scale_factor))
+        img = img.resize(enlarged_size, Image.LANCZOS)
+    return encode_page(img, quality, kind)
+
+
+def page_layout(quality_scale, upscale=False):
+    """画質設定から (画素の拡大率, 埋め込みDPI) を決める
+
+    既定では撮影した画素をそのまま埋め込み、DPIを READING_DPI / quality_scale にして
+    拡大方式と同じ物理ページサイズにする（拡大は表示時にビューアが行う）。
+    upscale=Trueの場合は従来どおり画素をLANCZOSで拡大して READING_DPI で埋め込む。
+    """
+    if upscale:
+        return quality_scale, READING_DPI
+    return 1.0, READING_DPI / quality_scale
+
+
+class ExportCancelled(Exception):
+    """PDF出力がキャンセルされた"""
+
+
+# umaskは読み出すにも一時的に書き換える必要があるので、他のスレッドがファイルを作り始める前の
+# インポート時に一度だけ読んでおく
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def new_file_mode(directory=False):
+    """umaskに従った、新しく作るファイル（ディレクトリ）の権限"""
+    return (0o777 if directory else 0o666) & ~_UMASK
+
+
+def replace_file(temp_path, path):
+    """一時ファイルを出力パスへ置き換える
+
+    mkstempの一時ファイルは所有者しか読めない(0600)ため、置き換える前に
+    既存のファイルの権限（なければumaskに従った通常の権限）に合わせる。
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = new_file_mode()
+    os.chmod(temp_path, mode)
+    os.replace(temp_path, path)
+
+
+class StreamingPdfWriter:
+    """ページを受け取るたびにエンコードして書き込み、メモリ使用量を1ページ分に抑える
+
+    書き込みは同じディレクトリの一時ファイルに対して行い、close()で
+    出力パスへリネームする。途中で失敗しても出力パスに壊れたPDFは残らない。
+    """
+
+    def __init__(self, path, resolution=READING_DPI, quality=85):
+        self.path = path
+        self.resolution = resolution
+        self.quality = quality
+        self.page_count = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, self.temp_path = tempfile.mkstemp(prefix=".", suffix=".pdf.part", dir=directory)
+        self._file = os.fdopen(fd, "wb")
+        self._offsets = {}
+        self._page_ids = []
+        # 1: Catalog, 2: Pages (ページツリーは最後に書き込む)
+        self._pages_ref = "2 0 R"
+        self._next_id = 3
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                self.close()
+            except BaseException:
+                # 書き込みやfsyncの失敗（容量不足など）でも書きかけのファイルを残さない
+                self.abort()
+                raise
+        else:
+            self.abort()
+        return False
+
+    def _allocate_id(self):
+        object_id = self._next_id
+        self._next_id += 1
+        return object_id
+
+    def _write_object(self, object_id, body, stream=None, generation=0):
+        self._offsets[object_id] = (self._file.tell(), generation)
+        self._file.write(f"{object_id} {generation} obj\n".encode("ascii"))
+        self._file.write(body if isinstance(body, bytes) else body.encode("ascii"))
+        if stream is not None:
+            self._file.write(b"\nstream\n")
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
+
+    def add_page(self, img, dpi=None, kind=None):
+        """画像を1ページとしてエンコードし、すぐにファイルへ書き込む"""
+        self.add_encoded_page(encode_page(img, self.quality, kind), dpi)
+
+    def add_encoded_page(self, page, dpi=None):
+        """エンコード済みのページを書き込む"""
+        dpi = dpi or self.resolution
+        image_id = self._allocate_id()
+        content_id = self._allocate_id()
+        page_id = self._allocate_id()
+
+        self._write_object(
+            image_id,
+            f"<< /Type /XObject /Subtype /Image /Width {page.width} /Height {page.height} "
+            f"/ColorSpace {page.color_space} /BitsPerComponent {page.bits} "
+            f"/Filter {page.filter} /Length {len(page.data)} >>",
+            page.data,
+        )
+
+        # ページサイズ(pt) = ピクセル数 * 72 / DPI
+        page_w = page.width * 72.0 / dpi
+        page_h = page.height * 72.0 / dpi
+        content = f"q {page_w:.4f} 0 0 {page_h:.4f} 0 0 cm /Im0 Do Q".encode("ascii")
+        self._write_object(content_id, f"<< /Length {len(content)} >>", content)
+
+        self._write_object(
+            page_id,
+            f"<< /Type /Page /Parent {self._pages_ref} /MediaBox [0 0 {page_w:.4f} {page_h:.4f}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>",
+        )
+        self._page_ids.append(page_id)
+        self.page_count += 1
+
+    def close(self):
+        """ページツリーと相互参照表を書き込み、出力パスへ置き換える"""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>")
+        self._write_object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+        self._write_xref(f"/Size {self._next_id} /Root 1 0 R")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        replace_file(self.temp_path, self.path)
+
+    def _write_xref(self, trailer):
+        """書き込んだオブジェクトの相互参照表とトレーラーを書き込む
+
+        番号が連続するオブジェクトごとにサブセクションを分ける（増分更新では飛び飛びになる）。
+        増分更新でも0番の空きエントリを先頭に置き、0番から始まる表を前提とするビューアに合わせる。
+        """
+        xref_offset = self._file.tell()
+        entries = {object_id: f"{offset:010d} {generation:05d} n \n"
+                   for object_id, (offset, generation) in self._offsets.items()}
+        entries[0] = "0000000000 65535 f \n"
+        lines = ["xref\n"]
+        run = []
+        for object_id in sorted(entries):
+            if run and run[-1] + 1 != object_id:
+                lines.append(f"{run[0]} {len(run)}\n")
+                lines.extend(entries[i] for i in run)
+                run = []
+            run.append(object_id)
+        lines.append(f"{run[0]} {len(run)}\n")
+        lines.extend(entries[i] for i in run)
+        lines.append(f"trailer\n<< {trailer} >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        self._file.write("".join(lines).encode("ascii"))
+
+    def abort(self):
+        """書き込みを中止し、一時ファイルを削除する"""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+_XREF_ENTRY_SIZE = 20
+_REF = rb"(\d+)\s+(\d+)\s+R"
+
+
+class _XrefChain:
+    """従来形式の相互参照表を新しい順にたどり、オブジェクトの位置を求める
+
+    相互参照表の1件は20バイト固定なので、サブセクションの見出しだけを読んで
+    目的の番号の位置へ直接シークする（ページ数に比例した読み込みは行わない）。
+    古い表（/Prev）は必要になったときだけ読む。
+    """
+
+    def __init__(self, f, startxref):
+        self._file = f
+        self._sections = []  # [(サブセクションのリスト, トレーラー)]（新しい順）
+        self._next = startxref
+        self.startxref = startxref
+        self.trailer = self._read_section()[1]
+
+    def _read_section(self):
+        f = self._file
+        f.seek(self._next)
+        if f.readline().strip() != b"xref":
+            raise ValueError("相互参照ストリーム形式のPDFには追記できません（従来形式の相互参照表のみ対応）")
+        subsections = []
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError("PDFの相互参照表が壊れています")
+            if line.strip().startswith(b"trailer"):
+                break
+            if not line.strip():
+                continue
+            start, count = (int(v) for v in line.split()[:2])
+            subsections.append((start, count, f.tell()))
+            f.seek(f.tell() + count * _XREF_ENTRY_SIZE)
+        trailer = line.strip()[len(b"trailer"):] + f.read(4096)
+        trailer = trailer[:trailer.find(b"startxref")] if b"startxref" in trailer else trailer
+        prev = re.search(rb"/Prev\s+(\d+)", trailer)
+        self._next = int(prev.group(1)) if prev else None
+        section = (subsections, trailer)
+        self._sections.append(section)
+        return section
+
+    def _sections_newest_first(self):
+        yield from list(self._sections)
+        while self._next is not None:
+            yield self._read_section()
+
+    def entry(self, object_id):
+        """オブジェクトの (位置, 世代番号) を返す（削除済み・存在しなければNone）"""
+        for subsections, _ in self._sections_newest_first():
+            for start, count, position in subsections:
+                if start <= object_id < start + count:
+                    self._file.seek(position + (object_id - start) * _XREF_ENTRY_SIZE)
+                    fields = self._file.read(_XREF_ENTRY_SIZE).split()
+                    if fields[2] != b"n":
+                        return None
+                    return int(fields[0]), int(fields[1])
+        return None
+
+    def all_entries(self):
+        """すべての表を読み、{番号: (位置, 世代番号)}（使用中の最新のもの）と、
+        表に現れたすべての位置（古いオブジェクトと相互参照表の位置を含む）を返す
+        """
+        live = {}
+        seen = set()
+        boundaries = set()
+        for subsections, _ in self._sections_newest_first():
+            for start, count, position in subsections:
+                boundaries.add(position)
+                self._file.seek(position)
+                table = self._file.read(count * _XREF_ENTRY_SIZE)
+                for i in range(count):
+                    fields = table[i * _XREF_ENTRY_SIZE:(i + 1) * _XREF_ENTRY_SIZE].split()
+                    offset = int(fields[0])
+                    if fields[2] == b"n":
+                        boundaries.add(offset)
+                    if start + i not in seen:
+                        seen.add(start + i)
+                        if fields[2] == b"n":
+                            live[start + i] = (offset, int(fields[1]))
+        return live, boundaries
+
+
+def _find_startxref(f):
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(max(0, size - 1024))
+    tail = f.read()
+    index = tail.rfind(b"startxref")
+    if index < 0:
+        raise ValueError("PDFの末尾にstartxrefが見つかりません")
+    return int(tail[index + len(b"startxref"):].split()[0])
+
+
+def _read_object(f, offset, limit=1 << 20):
+    """位置offsetのオブジェクトの本体（obj〜endobjの間）を読む（ストリームを含まないもの用）"""
+    f.seek(offset)
+    data = b""
+    while b"endobj" not in data:
+        chunk = f.read(65536)
+        if not chunk or len(data) > limit:
+            raise ValueError("PDFのオブジェクトを読み込めません")
+        data += chunk
+    body = data[:data.index(b"endobj")]
+    return body[body.index(b"obj") + 3:].strip()
+
+
+def _append_recovery_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}.appending")
+
+
+def _recover_interrupted_append(f, recovery_path):
+    """前回の追記がクラッシュや電源断で中断されていれば、PDFを追記前の長さに戻す"""
+    if not os.path.exists(recovery_path):
+        return
+    with open(recovery_path, encoding="ascii") as record:
+        text = record.read().strip()
+    f.seek(0, os.SEEK_END)
+    # 記録を書き終える前に中断した場合は、まだPDFに何も書き込んでいない
+    if text.isdigit() and int(text) < f.tell():
+        f.truncate(int(text))
+        f.flush()
+        os.fsync(f.fileno())
+        print(f"前回中断された追記を取り消しました（{int(text)}バイトに戻しました）")
+    os.remove(recovery_path)
+
+
+class AppendingPdfWriter(StreamingPdfWriter):
+    """既存のPDFの末尾に増分更新でページを追加する
+
+    既存のページは読み直さず、ページツリーの根（Pagesオブジェクト）だけを書き直して
+    新しいページのオブジェクトと相互参照表を追記する。途中で失敗した場合は
+    ファイルを元の長さに切り詰めるので、既存のPDFは壊れない。
+    追記中は元の長さを隠しファイル（.<名前>.appending）に記録しておき、クラッシュや
+    電源断で切り詰められなかった場合は、次に追記するときに元の長さへ戻す。
+    相互参照ストリーム形式（PDF 1.5以降の圧縮形式）と暗号化されたPDFには対応しない。
+    """
+
+    def __init__(self, path, resolution=READING_DPI, quality=85):
+        self.path = path
+        self.resolution = resolution
+        self.quality = quality
+        self.page_count = 0
+        self._offsets = {}
+        self._page_ids = []
+
+        self._recovery_path = _append_recovery_path(path)
+        self._file = open(path, "r+b")
+        try:
+            _recover_interrupted_append(self._file, self._recovery_path)
+            self._startxref = _find_startxref(self._file)
+            chain = _XrefChain(self._file, self._startxref)
+            trailer = chain.trailer
+            if b"/Encrypt" in trailer:
+                raise ValueError("暗号化されたPDFには追記できません")
+            root = re.search(rb"/Root\s+" + _REF, trailer)
+            size = re.search(rb"/Size\s+(\d+)", trailer)
+            if root is None or size is None:
+                raise ValueError("PDFのトレーラーにRootまたはSizeがありません")
+            self._root_ref = f"{int(root.group(1))} {int(root.group(2))} R"
+            # /Infoと/IDは新しいトレーラーにも引き継ぐ
+            self._trailer_extra = " ".join(
+                match.group(0).decode("latin-1")
+                for match in (re.search(rb"/Info\s+" + _REF, trailer), re.search(rb"/ID\s*\[[^\]]*\]", trailer))
+                if match
+            )
+            catalog = chain.entry(int(root.group(1)))
+            if catalog is None:
+                raise ValueError("PDFのカタログが見つかりません")
+            pages = re.search(rb"/Pages\s+" + _REF, _read_object(self._file, catalog[0]))
+            if pages is None:
+                raise ValueError("PDFのページツリーが見つかりません")
+            self._pages_id = int(pages.group(1))
+            self._pages_ref = f"{self._pages_id} {int(pages.group(2))} R"
+            entry = chain.entry(self._pages_id)
+            if entry is None:
+                raise ValueError("PDFのページツリーが見つかりません")
+            self._pages_generation = entry[1]
+            self._pages_body = _read_object(self._file, entry[0])
+            kids = re.search(rb"/Kids\s*\[", self._pages_body)
+            count = re.search(rb"/Count\s+(\d+)", self._pages_body)
+            if kids is None or count is None:
+                raise ValueError("PDFのページツリーの形式に対応していません")
+            self.existing_pages = int(count.group(1))
+            self._next_id = int(size.group(1))
+
+            self._file.seek(0, os.SEEK_END)
+            self._original_size = self._file.tell()
+            # PDFに書き込む前に元の長さを記録して確定させる
+            with open(self._recovery_path, "w", encoding="ascii") as record:
+                record.write(str(self._original_size))
+                record.flush()
+                os.fsync(record.fileno())
+            # 増分更新は既存の%%EOFの後ろから始める
+            self._file.write(b"\n")
+        except Exception:
+            self._file.close()
+            raise
+
+    def close(self):
+        """ページツリーの根を書き直し、追加分の相互参照表を書き込む"""
+        body = self._pages_body
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids).encode("ascii")
+        # 既存のKidsの末尾に新しいページを加え、ページ数を更新する
+        end = body.index(b"]", re.search(rb"/Kids\s*\[", body).end())
+        body = body[:end] + b" " + kids + body[end:]
+        body = re.sub(rb"/Count\s+\d+", f"/Count {self.existing_pages + self.page_count}".encode("ascii"), body,
+                      count=1)
+        self._write_object(self._pages_id, body, generation=self._pages_generation)
+        trailer = f"/Size {self._next_id} /Root {self._root_ref} /Prev {self._startxref}"
+        if self._trailer_extra:
+            trailer += " " + self._trailer_extra
+        self._write_xref(trailer)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.remove(self._recovery_path)
+
+    def abort(self):
+        """追記した分を切り詰めて、元のPDFに戻す"""
+        if not self._file.closed:
+            self._file.truncate(self._original_size)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        if os.path.exists(self._recovery_path):
+            os.remove(self._recovery_path)
+
+
+def compact_pdf(path):
+    """増分更新を重ねたPDFを、1つの相互参照表を持つファイルに書き直す
+
+    使用中のオブジェクトをバイト列のままコピーするだけで、画像の再エンコードはしない。
+    書き換えられて不要になった古いオブジェクト（ページツリーの根など）は取り除かれる。
+    """
+    with open(path, "rb") as source:
+        startxref = _find_startxref(source)
+        chain = _XrefChain(source, startxref)
+        trailer = chain.trailer
+        live, boundaries = chain.all_entries()
+        source.seek(0, os.SEEK_END)
+        boundaries.add(source.tell())
+        boundaries.add(startxref)
+        ordered = sorted(boundaries)
+        source.seek(0)
+        header = source.readline()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".pdf.part", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as target:
+                target.write(header)
+                target.write(b"%\xe2\xe3\xcf\xd3\n")
+                offsets = {}
+                for object_id in sorted(live):
+                    offset, generation = live[object_id]
+                    # オブジェクトの終わりは次に記録されている位置の手前の最後のendobj
+                    following = ordered[bisect.bisect_right(ordered, offset)]
+                    source.seek(offset)
+                    data = source.read(following - offset)
+                    data = data[:data.rindex(b"endobj") + len(b"endobj")]
+                    offsets[object_id] = (target.tell(), generation)
+                    target.write(data)
+                    target.write(b"\n")
+                size = max(offsets) + 1
+                xref_offset = target.tell()
+                lines = [f"xref\n0 {size}\n"]
+                for object_id in range(size):
+                    if object_id in offsets:
+                        lines.append(f"{offsets[object_id][0]:010d} {offsets[object_id][1]:05d} n \n")
+                    else:
+                        lines.append("0000000000 65535 f \n")
+                trailer = re.sub(rb"\s*/Prev\s+\d+", b"", trailer.strip())
+                trailer = re.sub(rb"/Size\s+\d+", f"/Size {size}".encode("ascii"), trailer, count=1)
+                lines.append("trailer\n")
+                target.write("".join(lines).encode("ascii"))
+                target.write(trailer)
+                target.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+                target.flush()
+                os.fsync(target.fileno())
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    replace_file(temp_path, path)
+    print(f"PDFを最適化しました: {path}")
@@ -0,0 +1,153 @@
+"""撮影セッションのジャーナル（クラッシュ後に撮影を再開するための記録）"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+SESSIONS_DIR = os.path.join(os.path.expanduser("~"), ".auto_screenshot", "sessions")
+MANIFEST_NAME = "manifest.jsonl"
+
+
+class SessionJournal:
+    """セッションディレクトリにページファイルと追記専用のマニフェストを保存する
+
+    マニフェストは1行1レコードのJSON。ページを書くたびにflushし、fsyncは
+    fsync_every件ごと、またはfsync_interval秒ごとにまとめて行う。マニフェストより先に
+    その間に記録したページファイルとディレクトリをfsyncし、マニフェストにあるページが
+    ディスクに残っていない状態を防ぐ。
+    """
+
+    def __init__(self, directory, fsync_every=8, fsync_interval=2.0):
+        self.directory = directory
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        path = os.path.join(directory, MANIFEST_NAME)
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                # クラッシュで途中まで書かれた行があれば、次のレコードと混ざらないように改行する
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+        self._unsynced = 0
+        self._unsynced_pages = []
+        self._last_sync = time.monotonic()
+
+    @classmethod
+    def create(cls, settings, root=SESSIONS_DIR):
+        """新しいセッションディレクトリを作り、撮影設定をヘッダとして記録する"""
+        os.makedirs(root, exist_ok=True)
+        name = time.strftime("%Y%m%d-%H%M%S")
+        directory = os.path.join(root, name)
+        suffix = 1
+        while os.path.exists(directory):
+            directory = os.path.join(root, f"{name}-{suffix}")
+            suffix += 1
+        os.makedirs(directory)
+        journal = cls(directory)
+        journal._append({"type": "session", "time": time.time(), **settings}, sync=True)
+        return journal
+
+    def _append(self, record, sync=False):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        now = time.monotonic()
+        if sync or self._unsynced >= self.fsync_every or now - self._last_sync >= self.fsync_interval:
+            self._sync()
+            self._last_sync = now
+
+    def _sync(self):
+        if self._unsynced_pages:
+            for path in self._unsynced_pages:
+                # Windowsでは書き込み可能なハンドルでないとfsyncできない
+                with open(path, "r+b") as f:
+                    os.fsync(f.fileno())
+            if os.name != "nt":
+                # 新しく作ったファイルの名前（ディレクトリのエントリ）も確定させる
+                fd = os.open(self.directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            self._unsynced_pages = []
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def record_page(self, index, page_id, entry, digest, area, click_position):
+        """ストアに書き出したページをマニフェストに追記する"""
+        self._unsynced_pages.append(entry.path)
+        self._append({
+            "type": "page",
+            "index": index,
+            "page_id": page_id,
+            "time": time.time(),
+            "sha1": digest,
+            "file": os.path.basename(entry.path),
+            "size": list(entry.size),
+            "mode": entry.mode,
+            "area": list(area),
+            "click": list(click_position),
+        })
+
+    def close(self):
+        if not self._file.closed:
+            self._sync()
+            self._file.close()
+
+    def discard(self):
+        """セッションを完了扱いにしてディレクトリごと削除する"""
+        self.close()
+        discard_session(self.directory)
+
+
+def load_session(directory):
+    """マニフェストを読み込み、(撮影設定, ページレコードのリスト) を返す
+
+    クラッシュで途中まで書かれた行や、ファイルが残っていないか内容が記録した
+    SHA-1と一致しない（途中までしか書かれなかった）ページは読み飛ばす。
+    """
+    settings = {}
+    pages = []
+    with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("type") == "session":
+                settings = record
+            elif record.get("type") == "page":
+                if _page_file_intact(os.path.join(directory, record["file"]), record.get("sha1")):
+                    pages.append(record)
+                else:
+                    print(f"{record.get('index')}枚目に撮影したページのファイルが壊れているため読み飛ばします")
+    return settings, pages
+
+
+def _page_file_intact(path, digest):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return False
+    if not data:
+        return False
+    return digest is None or hashlib.sha1(data).hexdigest() == digest
+
+
+def find_sessions(root=SESSIONS_DIR):
+    """再開できるセッションディレクトリを新しい順に返す"""
+    if not os.path.isdir(root):
+        return []
+    sessions = [
+        os.path.join(root, name) for name in os.listdir(root)
+        if os.path.exists(os.path.join(root, name, MANIFEST_NAME))
+    ]
+    return sorted(sessions, reverse=True)
+
+
+def discard_session(directory):
+    shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,105 @@
+"""撮影・出力の各ステージの所要時間を計測する
+
+計測を無効にしたときはNULL_TELEMETRYを使う。record()は何もしない関数なので、
+呼び出し側は有効/無効を気にせず同じコードで計測できる。
+"""
+import json
+import threading
+import time
+
+from capture_pipeline import PipelineStats
+
+# 表示・集計に使うステージ名
+STAGE_LABELS = {
+    "wait": "待機",
+    "click": "クリック",
+    "click_to_capture": "クリック→撮影",
+    "capture": "撮影",
+    "trim": "余白除去",
+    "enhance": "鮮明化",
+    "compact": "白黒判定",
+    "hash": "ハッシュ",
+    "split": "見開き分割",
+    "encode": "PNG変換",
+    "store": "保存",
+    "page": "1ページ",
+    "export_wait": "PDF変換待ち",
+    "export_write": "PDF書き込み",
+    "export_page": "PDF 1ページ",
+}
+
+
+class Telemetry(PipelineStats):
+    """ステージごとの回数と合計時間を集計し、指定があればJSON Lines形式のトレースに追記する
+
+    CapturePipelineの統計としてもそのまま使える。
+    """
+    enabled = True
+
+    def __init__(self, trace_path=None):
+        super().__init__()
+        self.last = {}
+        self._trace_lock = threading.Lock()
+        self._trace = open(trace_path, "a", encoding="utf-8") if trace_path else None
+
+    def record(self, stage, seconds, page=None):
+        super().record(stage, seconds)
+        self.last[stage] = seconds
+        if self._trace is not None:
+            line = json.dumps({"time": round(time.time(), 4), "stage": stage, "seconds": round(seconds, 6),
+                               "page": page})
+            with self._trace_lock:
+                if not self._trace.closed:
+                    self._trace.write(line + "\n")
+
+    def eta(self, stage, remaining):
+        """1件あたりの平均時間から残り時間（秒）を見積もる"""
+        average = self.average_seconds(stage)
+        return average * remaining if average else None
+
+    def summary(self):
+        """ステージごとの回数・平均・合計（秒）"""
+        with self._lock:
+            return {
+                stage: {
+                    "count": count,
+                    "average": round(self.seconds[stage] / count, 6),
+                    "total": round(self.seconds[stage], 4),
+                }
+                for stage, count in self.counts.items()
+            }
+
+    def close(self):
+        if self._trace is not None:
+            with self._trace_lock:
+                self._trace.close()
+
+
+class NullTelemetry:
+    """計測を無効にしたときの何もしない実装"""
+    enabled = False
+
+    def record(self, stage, seconds, page=None):
+        pass
+
+    def eta(self, stage, remaining):
+        return None
+
+    def summary(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+NULL_TELEMETRY = NullTelemetry()
+
+
+def format_duration(seconds):
+    """残り時間を「3分20秒」のように表す"""
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return f"{seconds // 3600}時間{seconds % 3600 // 60}分"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60}秒"
+    return f"{seconds}秒"